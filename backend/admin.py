@@ -1,14 +1,16 @@
-import requests as rqs
-import yaml
 from django.contrib import admin
 from django.contrib.admin import helpers
+from django.db import transaction
 from django.template.response import TemplateResponse
 from django.urls import path
+from django.utils import timezone
 
 from .models import (Shop, Category, ProductInfo, ProductParameter, User,
                      ConfirmEmailToken, Address, Order, OrderItem, Delivery,
+                     ImportJob, OutboxEmail, AdminNotification,
                      STATE_CHOICES)
-from .tasks import send_email_task, do_import_task
+from .tasks import send_email_task, fetch_price_lists_task, \
+    start_email_dispatch
 
 
 # Register your models here.
@@ -142,6 +144,7 @@ class ShopAdmin(admin.ModelAdmin):
         )
         ids = request.GET.get('ids')
         updating, not_updated, already_updated = [], dict(), []
+        jobs = []
 
         for shop_id in ids.split(','):
             shop = Shop.objects.get(id=shop_id)
@@ -150,35 +153,85 @@ class ShopAdmin(admin.ModelAdmin):
                 already_updated.append(shop.name)
                 continue
 
-            if shop.file:
-                stream = shop.file
-            elif shop.url:
-                try:
-                    result = rqs.get(shop.url)
-                except rqs.exceptions.ConnectionError:
-                    not_updated[shop.name] = 'Нет соединения'
-                    continue
-                else:
-                    if result.ok:
-                        stream = result.content
-                    else:
-                        not_updated[shop.name] = 'Файл не найден'
-                        continue
-            else:
+            if not shop.file and not shop.url:
                 not_updated[shop.name] = 'Нет файла для актуализации'
                 continue
 
-            data = yaml.safe_load(stream)
-            do_import_task(shop_id, data)
-            updating.append(data['shop'])
+            # загрузка выполняется в фоне, прогресс виден в списке загрузок
+            jobs.append(ImportJob.objects.create(shop=shop))
+            updating.append(shop.name)
+
+        if jobs:
+            # прайс-листы по ссылкам скачиваются параллельно
+            job_ids = [job.id for job in jobs]
+            transaction.on_commit(
+                lambda: fetch_price_lists_task.delay(job_ids)
+            )
 
         context.update(updating=updating,
                        not_updated=not_updated,
-                       already_updated=already_updated)
+                       already_updated=already_updated,
+                       jobs=jobs)
         return TemplateResponse(request,
                                 "admin/backend/shop/update_result.html",
                                 context)
 
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    fields = (('id', 'shop'), ('state', 'incremental'),
+              ('rows_processed', 'stats'),
+              ('file', 'url_etag', 'url_last_modified'),
+              ('created_at', 'started_at', 'finished_at', 'duration'),
+              'errors')
+    readonly_fields = ('id', 'shop', 'state', 'incremental', 'rows_processed',
+                       'stats', 'file', 'url_etag', 'url_last_modified',
+                       'created_at', 'started_at', 'finished_at',
+                       'duration', 'errors')
+    list_display = ('id', 'shop', 'state', 'rows_processed', 'created_at',
+                    'duration')
+    list_filter = ('state', 'shop')
+    list_select_related = ('shop',)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.action(description='Отправить выбранные письма повторно')
+def resend_emails(modeladmin, request, queryset):
+    # письма, которые сейчас отправляются, не трогаем
+    queryset.exclude(state__in=('sent', 'sending')).update(
+        state='pending', attempts=0, next_attempt_at=timezone.now()
+    )
+    transaction.on_commit(start_email_dispatch)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    fields = (('title', 'sender'), 'recipients', 'message',
+              ('state', 'attempts', 'next_attempt_at'),
+              ('created_at', 'sent_at'), 'errors')
+    readonly_fields = ('title', 'sender', 'recipients', 'message',
+                       'state', 'attempts', 'next_attempt_at',
+                       'created_at', 'sent_at', 'errors')
+    list_display = ('title', 'state', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('state',)
+    actions = [resend_emails, ]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(AdminNotification)
+class AdminNotificationAdmin(admin.ModelAdmin):
+    fields = (('event', 'created_at', 'sent_at'), 'message')
+    readonly_fields = ('event', 'message', 'created_at', 'sent_at')
+    list_display = ('event', 'message', 'created_at', 'sent_at')
+    list_filter = ('event', ('sent_at', admin.EmptyFieldListFilter))
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(Category)
 admin.site.register(ConfirmEmailToken)
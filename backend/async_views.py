@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from orders.profiling import install_query_recorder
+
+# потоки для синхронного кода асинхронных представлений, их количество
+# ограничивает число одновременных соединений с базой
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEW_THREADS,
+                              thread_name_prefix='async-view')
+
+
+def database_sync_to_async(func):
+    """
+    Асинхронная версия func, выполняемая в потоке executor. Соединения
+    с базой этого потока закрываются по CONN_MAX_AGE и при ошибках,
+    как после обычного HTTP-запроса, запросы к базе учитываются
+    профилированием.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        install_query_recorder()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False, executor=executor)
+
+
+def async_view(view):
+    """
+    Асинхронная обертка представления DRF для ASGI: запрос к базе
+    и формирование ответа выполняются в потоке executor. Синхронные
+    представления Django 3.2 под ASGI выполняются по очереди в одном
+    потоке процесса, асинхронные - одновременно, пока есть свободные
+    потоки.
+    """
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    render = database_sync_to_async(render)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await render(request, *args, **kwargs)
+
+    return wrapper
+
+
+def as_view(view_class):
+    """
+    Представление для urls: при ASYNC_VIEWS (ASGI) - асинхронное,
+    иначе обычное синхронное
+    """
+    view = view_class.as_view()
+    return async_view(view) if settings.ASYNC_VIEWS else view
@@ -0,0 +1,140 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from orders.routers import primary
+
+from .cache import is_local_cache
+from .models import User
+
+# поля пользователя в кэше: все, кроме хэша пароля (загружается
+# из базы при обращении)
+USER_CACHE_FIELDS = [field.attname for field in User._meta.concrete_fields
+                     if field.attname != 'password']
+
+
+def get_token_cache():
+    return caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+
+
+def is_token_cache_used():
+    """
+    Токены кэшируются только в общем кэше: удаление из кэша в памяти
+    процесса не видно другим процессам, и они принимали бы удаленный
+    токен или заблокированного пользователя
+    """
+    return not is_local_cache(settings.AUTH_TOKEN_CACHE_ALIAS)
+
+
+def get_token_cache_key(key):
+    # в кэше хранится хэш токена, а не сам токен
+    return 'auth_token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_generation_key(cache_key):
+    # счетчик изменений токена и его пользователя
+    return cache_key + ':generation'
+
+
+def get_generation(cache, cache_key):
+    """
+    Текущее значение счетчика. Начальное значение берется из текущего
+    времени, поэтому после вытеснения ключа счетчик не повторяет
+    прежние значения
+    """
+    generation_key = get_generation_key(cache_key)
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, int(time.time()), timeout=None)
+        generation = cache.get(generation_key)
+    return generation
+
+
+def invalidate_token_keys(keys):
+    """
+    Увеличивает счетчики токенов и удаляет токены из кэша:
+    записи, собранные до изменения, больше не принимаются
+    """
+    cache = get_token_cache()
+    cache_keys = [get_token_cache_key(key) for key in keys]
+    for cache_key in cache_keys:
+        try:
+            cache.incr(get_generation_key(cache_key))
+        except ValueError:
+            # ключа нет в кэше
+            get_generation(cache, cache_key)
+    cache.delete_many(cache_keys)
+
+
+def invalidate_token(key):
+    """
+    Удаляет токен из кэша после фиксации транзакции
+    """
+    if not is_token_cache_used():
+        return
+    transaction.on_commit(lambda: invalidate_token_keys([key]))
+
+
+def invalidate_user_tokens(*user_ids):
+    """
+    Удаляет из кэша токены пользователей после фиксации транзакции.
+    QuerySet.update() не отправляет post_save, после массового изменения
+    пользователей (is_active, пароль) вызывать явно.
+    """
+    if not is_token_cache_used():
+        return
+
+    def invalidate():
+        with primary():
+            keys = list(Token.objects.filter(
+                user_id__in=user_ids
+            ).values_list('key', flat=True))
+        invalidate_token_keys(keys)
+
+    transaction.on_commit(invalidate)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшем проверенных токенов на
+    AUTH_TOKEN_CACHE_TIMEOUT секунд: пока токен в кэше, запрос
+    к базе за токеном и пользователем не выполняется. Токен удаляется
+    из кэша при удалении токена и при изменении пользователя (пароль,
+    is_active), см. signals. С кэшем в памяти процесса токен каждый раз
+    проверяется по базе.
+
+    Запись в кэше содержит значение счетчика токена, прочитанное
+    до запроса к базе, и принимается, только пока счетчик не изменился:
+    изменение, зафиксированное во время запроса к базе, не оставляет
+    в кэше прежнего пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        if not is_token_cache_used():
+            return super().authenticate_credentials(key)
+
+        cache = get_token_cache()
+        cache_key = get_token_cache_key(key)
+        generation_key = get_generation_key(cache_key)
+        cached = cache.get_many([cache_key, generation_key])
+        entry = cached.get(cache_key)
+        generation = cached.get(generation_key)
+        if entry is not None and entry['generation'] == generation:
+            user = User.from_db(router.db_for_read(User), USER_CACHE_FIELDS,
+                                entry['user'])
+            return user, Token(key=key, user=user, created=entry['created'])
+
+        if generation is None:
+            generation = get_generation(cache, cache_key)
+        user, token = super().authenticate_credentials(key)
+        cache.set(cache_key, {
+            'generation': generation,
+            'user': [getattr(user, field) for field in USER_CACHE_FIELDS],
+            'created': token.created,
+        }, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        return user, token
@@ -0,0 +1,177 @@
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .cache import bump_catalog_version
+from .catalog import refresh_catalog_quantities
+from .models import Address, Order, OrderItem, ProductInfo
+from .delivery import delivery_index
+from .serializers import set_shop_deliveries
+
+
+class CheckoutError(Exception):
+    """
+    Заказ не может быть размещен, errors - причина или список причин
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def merge_items(items):
+    """
+    Складывает количество повторяющихся позиций:
+    словарь id информации о продукте -> количество
+    """
+    quantities = {}
+    for item in items:
+        product_info_id = item['product_info']
+        quantities[product_info_id] = \
+            quantities.get(product_info_id, 0) + item['quantity']
+    return quantities
+
+
+def find_missing_product_infos(product_info_ids):
+    """
+    id информации о продуктах, которых нет в базе (один запрос)
+    """
+    existing = set(ProductInfo.objects.filter(
+        id__in=product_info_ids
+    ).values_list('id', flat=True))
+    return sorted(set(product_info_ids).difference(existing))
+
+
+def add_basket_items(user_id, quantities):
+    """
+    Добавляет позиции в корзину пользователя одной транзакцией.
+    Количество у позиций, уже лежащих в корзине, увеличивается,
+    остальные позиции вставляются через bulk_create.
+    Корзина блокируется на время добавления, поэтому одновременные
+    запросы не нарушают unique_order_item.
+    Возвращает количество созданных и обновленных позиций.
+    """
+    with transaction.atomic():
+        basket, _ = Order.objects.select_for_update().get_or_create(
+            user_id=user_id, state='basket'
+        )
+        existing = list(OrderItem.objects.filter(
+            order_id=basket.id, product_info_id__in=quantities
+        ))
+        for order_item in existing:
+            order_item.quantity += quantities[order_item.product_info_id]
+        OrderItem.objects.bulk_update(existing, fields=['quantity'])
+
+        existing_ids = {order_item.product_info_id for order_item in existing}
+        created = OrderItem.objects.bulk_create(
+            [OrderItem(order_id=basket.id, product_info_id=product_info_id,
+                       quantity=quantity)
+             for product_info_id, quantity in quantities.items()
+             if product_info_id not in existing_ids]
+        )
+    return len(created), len(existing)
+
+
+def update_basket_items(basket_id, quantities):
+    """
+    Меняет количество у позиций корзины (словарь id позиции -> количество)
+    одной транзакцией: позиции с количеством 0 удаляются одним запросом,
+    остальные обновляются одним запросом UPDATE ... CASE (bulk_update).
+    Возвращает количество обновленных и удаленных позиций.
+    """
+    to_delete = [item_id for item_id, qty in quantities.items() if qty == 0]
+    with transaction.atomic():
+        order_items = list(OrderItem.objects.select_for_update().filter(
+            order_id=basket_id,
+            id__in=[item_id for item_id, qty in quantities.items() if qty]
+        ))
+        for order_item in order_items:
+            order_item.quantity = quantities[order_item.id]
+        OrderItem.objects.bulk_update(order_items, fields=['quantity'])
+
+        deleted_count = 0
+        if to_delete:
+            deleted_count, _ = OrderItem.objects.filter(
+                order_id=basket_id, id__in=to_delete
+            ).delete()
+    return len(order_items), deleted_count
+
+
+def get_basket_totals(basket_id):
+    """
+    Итоги корзины без загрузки позиций: сумма товаров и стоимость
+    доставки так же, как в OrderSerializer (один запрос, доставка
+    берется из delivery_index)
+    """
+    shops = [
+        {'id': shop_id, 'name': name, 'shop_sum': shop_sum}
+        for shop_id, name, shop_sum in OrderItem.objects.filter(
+            order_id=basket_id
+        ).values_list(
+            'product_info__shop_id', 'product_info__shop__name'
+        ).annotate(
+            shop_sum=Sum(F('quantity') * F('product_info__price'))
+        ).order_by('product_info__shop_id')
+    ]
+    total_delivery = set_shop_deliveries(
+        shops, delivery_index.get_tiers([shop['id'] for shop in shops])
+    )
+    return {'total_sum': sum(shop['shop_sum'] for shop in shops),
+            'total_delivery': total_delivery}
+
+
+def place_order(user_id, address_id):
+    """
+    Размещает заказ из корзины пользователя одной транзакцией.
+
+    Корзина и информация о заказанных продуктах блокируются
+    (select_for_update, продукты - в порядке id, чтобы одновременные
+    заказы не блокировали друг друга взаимно; общие для магазинов
+    строки Product не блокируются), затем проверяются
+    остатки, остатки уменьшаются одним запросом и корзина получает
+    статус 'new'. При нехватке товара, недоступной доставке или чужом
+    адресе возникает CheckoutError и ничего не изменяется.
+    Возвращает размещенный заказ.
+    """
+    with transaction.atomic():
+        basket = Order.objects.select_for_update().filter(
+            user_id=user_id, state='basket'
+        ).first()
+        if basket is None:
+            raise CheckoutError('Нет заказа со статусом корзины')
+
+        ordered = dict(OrderItem.objects.filter(
+            order_id=basket.id
+        ).values_list('product_info_id', 'quantity'))
+        if not ordered:
+            raise CheckoutError('Корзина пуста')
+
+        total_delivery = get_basket_totals(basket.id)['total_delivery']
+        if isinstance(total_delivery, list):
+            raise CheckoutError(total_delivery)
+
+        if not Address.objects.filter(id=address_id,
+                                      user_id=user_id).exists():
+            raise CheckoutError('Адрес не найден')
+
+        product_infos = list(ProductInfo.objects.select_for_update(
+            of=('self',)
+        ).filter(id__in=ordered).select_related('product').order_by('id'))
+        errors = [f"{product_info.product.name}: недостаточно товара "
+                  f"(в наличии {product_info.quantity})"
+                  for product_info in product_infos
+                  if product_info.quantity < ordered[product_info.id]]
+        if errors:
+            raise CheckoutError(errors)
+
+        for product_info in product_infos:
+            product_info.quantity -= ordered[product_info.id]
+        ProductInfo.objects.bulk_update(product_infos, fields=['quantity'])
+        refresh_catalog_quantities({product_info.id: product_info.quantity
+                                    for product_info in product_infos})
+        # остатки входят в кэшированные ответы каталога
+        bump_catalog_version()
+
+        basket.address_id = address_id
+        basket.state = 'new'
+        basket.save(update_fields=['address', 'state'])
+    return basket
@@ -0,0 +1,139 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from orders.routers import primary
+
+CATALOG_VERSION_KEY = 'catalog:version'
+DELIVERY_VERSION_KEY = 'delivery:version'
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def is_local_cache(alias):
+    """
+    Кэш в памяти процесса: изменения в нем не видны другим процессам
+    """
+    return isinstance(caches[alias], LocMemCache)
+
+
+def get_version(key):
+    """
+    Текущее значение счетчика версии. Начальное значение берется
+    из текущего времени, поэтому после вытеснения ключа из кэша
+    версия не повторяет прежние значения
+    """
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time()), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    Увеличивает версию после фиксации текущей транзакции,
+    чтобы новые данные не были собраны из ещё не сохраненных
+    """
+    def bump():
+        cache = get_cache()
+        try:
+            cache.incr(key)
+        except ValueError:
+            # ключа нет в кэше
+            get_version(key)
+
+    transaction.on_commit(bump)
+
+
+def get_catalog_version():
+    """
+    Текущая версия каталога. Версия входит в ключи кэша ответов,
+    поэтому после её увеличения прежние ответы больше не читаются
+    и вытесняются кэшем (LRU)
+    """
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def get_delivery_version():
+    """
+    Версия стоимости доставки для таблиц доставки в памяти процессов
+    """
+    return get_version(DELIVERY_VERSION_KEY)
+
+
+def bump_delivery_version():
+    bump_version(DELIVERY_VERSION_KEY)
+
+
+def get_response_key(request):
+    """
+    Ключ кэша ответа: версия каталога, адрес, отсортированные параметры
+    запроса и формат ответа
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    content = '|'.join([request.get_host(), request.path, query,
+                        request.META.get('HTTP_ACCEPT', '')])
+    return 'response:{}:{}'.format(
+        get_catalog_version(),
+        hashlib.md5(content.encode()).hexdigest()
+    )
+
+
+def cache_response(view_method):
+    """
+    Кэширует успешные ответы метода get представления DRF.
+
+    Проверки доступа и ограничения частоты запросов выполняются
+    как обычно, из кэша берется только готовое содержимое ответа.
+    Ответ содержит ETag, по заголовку If-None-Match возвращается 304.
+    С кэшем в памяти процесса ответы не кэшируются: версия каталога,
+    увеличенная в другом процессе (импорт в celery, заказ), в нем
+    не видна.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if is_local_cache(settings.RESPONSE_CACHE_ALIAS):
+            return view_method(self, request, *args, **kwargs)
+
+        cache = get_cache()
+        key = get_response_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            # ответ хранится до изменения данных, поэтому читается
+            # с основной базы: реплика может еще не получить изменение
+            with primary():
+                response = view_method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response = self.finalize_response(request, response,
+                                              *args, **kwargs)
+            response.render()
+            etag = '"{}"'.format(
+                hashlib.md5(response.content).hexdigest()
+            )
+            cached = (response.content, response['Content-Type'], etag)
+            cache.set(key, cached, settings.RESPONSE_CACHE_TIMEOUT)
+
+        content, content_type, etag = cached
+        response = get_conditional_response(request, etag=etag) \
+            or HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        return response
+
+    return wrapper
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import CatalogEntry, Delivery, ProductInfo, Shop
+from .utils import chunked
+
+
+def get_shop_delivery(shop_id):
+    """
+    Доставка магазина в том виде, в котором её выводит ShopSerializer
+    """
+    return [{'min_sum': min_sum, 'cost': cost}
+            for min_sum, cost in Delivery.objects.filter(
+                shop_id=shop_id
+            ).order_by('min_sum').values_list('min_sum', 'cost')]
+
+
+def build_catalog_entry(product_info):
+    product, shop = product_info.product, product_info.shop
+    return CatalogEntry(
+        product_info_id=product_info.id,
+        external_id=product_info.external_id,
+        model=product_info.model,
+        product_name=product.name,
+        category_id=product.category_id,
+        category_name=product.category.name,
+        shop_id=shop.id,
+        shop_name=shop.name,
+        shop_state=shop.state,
+        shop_delivery=[{'min_sum': delivery.min_sum, 'cost': delivery.cost}
+                       for delivery in shop.delivery.all()],
+        quantity=product_info.quantity,
+        price=product_info.price,
+        price_rrc=product_info.price_rrc,
+        parameters=[{'parameter': product_parameter.parameter.name,
+                     'value': product_parameter.value}
+                    for product_parameter
+                    in product_info.product_parameters.all()],
+    )
+
+
+def refresh_catalog(product_info_ids=None, batch_size=None):
+    """
+    Пересобирает записи каталога для информации о продуктах
+    product_info_ids (всех, если не указаны)
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    if product_info_ids is None:
+        product_info_ids = ProductInfo.objects.order_by(
+            'id'
+        ).values_list('id', flat=True)
+
+    with transaction.atomic():
+        for ids in chunked(product_info_ids, batch_size):
+            product_infos = ProductInfo.objects.filter(
+                id__in=ids
+            ).select_related(
+                'shop', 'product__category'
+            ).prefetch_related(
+                'shop__delivery', 'product_parameters__parameter'
+            )
+            CatalogEntry.objects.filter(product_info_id__in=ids).delete()
+            CatalogEntry.objects.bulk_create(
+                [build_catalog_entry(product_info)
+                 for product_info in product_infos],
+                batch_size=batch_size
+            )
+
+
+def refresh_catalog_shop(shop_id):
+    """
+    Обновляет данные магазина (название, статус, доставку)
+    во всех его записях каталога одним запросом
+    """
+    shop = Shop.objects.filter(id=shop_id).values('name', 'state').first()
+    if shop is None:
+        return
+    CatalogEntry.objects.filter(shop_id=shop_id).update(
+        shop_name=shop['name'],
+        shop_state=shop['state'],
+        shop_delivery=get_shop_delivery(shop_id)
+    )
+
+
+def refresh_catalog_category(category_id, name):
+    CatalogEntry.objects.filter(category_id=category_id).update(
+        category_name=name
+    )
+
+
+def refresh_catalog_quantities(quantities):
+    """
+    Обновляет остатки в каталоге одним запросом
+    (словарь id информации о продукте -> количество)
+    """
+    CatalogEntry.objects.bulk_update(
+        [CatalogEntry(product_info_id=product_info_id, quantity=quantity)
+         for product_info_id, quantity in quantities.items()],
+        fields=['quantity']
+    )
@@ -0,0 +1,92 @@
+import threading
+import time
+from bisect import bisect_right
+
+from django.conf import settings
+
+from orders.routers import primary
+
+from .cache import get_delivery_version, is_local_cache
+from .models import Delivery
+
+# уровни доставки магазина без доставки
+NO_TIERS = ((), ())
+
+
+class DeliveryIndex:
+    """
+    Уровни стоимости доставки магазинов в памяти процесса:
+    для каждого магазина отсортированные min_sum и соответствующие
+    стоимости. Недостающие магазины загружаются одним запросом,
+    при изменении версии доставки (bump_delivery_version) и не реже
+    чем раз в DELIVERY_INDEX_TIMEOUT секунд таблица загружается заново.
+
+    Версия хранится в кэше RESPONSE_CACHE_ALIAS. Если это кэш в памяти
+    процесса, изменения доставки в других процессах не видны, поэтому
+    таблица не сохраняется и уровни читаются из базы при каждом вызове.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.expires = 0
+        self.tiers = {}
+
+    def clear(self):
+        with self.lock:
+            self.version, self.tiers = None, {}
+
+    def get_tiers(self, shop_ids):
+        """
+        Словарь id магазина -> (min_sums, costs)
+        """
+        if is_local_cache(settings.RESPONSE_CACHE_ALIAS):
+            return self.load_tiers(shop_ids)
+
+        version = get_delivery_version()
+        now = time.monotonic()
+        with self.lock:
+            if version != self.version or now >= self.expires:
+                self.version, self.tiers = version, {}
+                self.expires = now + settings.DELIVERY_INDEX_TIMEOUT
+            tiers = self.tiers
+
+        missing = set(shop_ids).difference(tiers)
+        if missing:
+            tiers.update(self.load_tiers(missing))
+
+        return {shop_id: tiers.get(shop_id, NO_TIERS)
+                for shop_id in shop_ids}
+
+    @staticmethod
+    def load_tiers(shop_ids):
+        loaded = {shop_id: ([], []) for shop_id in shop_ids}
+        # уровни хранятся до изменения доставки, поэтому читаются
+        # с основной базы
+        with primary():
+            rows = list(Delivery.objects.filter(
+                shop_id__in=loaded
+            ).order_by('shop_id', 'min_sum').values_list(
+                'shop_id', 'min_sum', 'cost'
+            ))
+        for shop_id, min_sum, cost in rows:
+            loaded[shop_id][0].append(min_sum)
+            loaded[shop_id][1].append(cost)
+        return {shop_id: (tuple(min_sums), tuple(costs))
+                for shop_id, (min_sums, costs) in loaded.items()}
+
+
+delivery_index = DeliveryIndex()
+
+
+def get_delivery_cost(tiers, shop_sum):
+    """
+    Стоимость доставки для суммы заказа shop_sum: уровень с наибольшей
+    min_sum, не превышающей сумму. Возвращает None, если сумма меньше
+    минимальной.
+    """
+    min_sums, costs = tiers
+    index = bisect_right(min_sums, shop_sum)
+    if index == 0:
+        return None
+    return costs[index - 1]
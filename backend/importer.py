@@ -0,0 +1,310 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import transaction
+
+from .catalog import refresh_catalog
+from .models import Category, ProductInfo, Product, Parameter, \
+    ProductParameter
+from .price_list import iter_data
+from .utils import chunked
+
+
+def get_item_digest(item):
+    """
+    Хэш товара из прайс-листа, не зависящий от порядка ключей
+    """
+    content = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class PriceListImporter:
+    """
+    Загрузка прайс-листа магазина пакетными запросами.
+
+    Категории, продукты и имена параметров определяются несколькими
+    запросами на пакет товаров, информация о продуктах и их параметры
+    вставляются через bulk_create. Вся загрузка выполняется в одной
+    транзакции.
+    """
+
+    # поля информации о продукте, сравниваемые при обновлении
+    UPDATE_FIELDS = ('product_id', 'model', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, shop, batch_size=None, incremental=False,
+                 progress=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.incremental = incremental
+        # функция, получающая количество обработанных позиций
+        self.progress = progress
+        self.rows_processed = 0
+        # кэш имя параметра -> id на время загрузки
+        self.parameters = {}
+        self.stats = {'created': 0, 'updated': 0,
+                      'deleted': 0, 'unchanged': 0}
+
+    def import_data(self, data):
+        """
+        Загружает уже разобранный прайс-лист (словарь)
+        """
+        return self.import_records(iter_data(data))
+
+    def import_records(self, records):
+        """
+        Загружает прайс-лист из итератора записей (ключ, значение)
+        и возвращает количество созданных, обновленных, удаленных
+        и неизмененных позиций. Товары записываются пакетами
+        по batch_size, поэтому расход памяти не зависит от размера
+        прайс-листа.
+
+        В полном режиме позиции магазина удаляются и создаются заново.
+        В инкрементальном режиме позиции сопоставляются по external_id,
+        и записываются только изменения.
+        """
+        with transaction.atomic():
+            # id позиций магазина, которых нет в новом прайс-листе
+            remaining = set()
+            if self.incremental:
+                remaining.update(ProductInfo.objects.filter(
+                    shop_id=self.shop.id
+                ).values_list('id', flat=True))
+            else:
+                _, deleted = ProductInfo.objects.filter(
+                    shop_id=self.shop.id
+                ).delete()
+                self.stats['deleted'] = deleted.get(
+                    ProductInfo._meta.label, 0
+                )
+
+            goods = []
+            for key, value in records:
+                if key == 'shop':
+                    self.shop.name = value
+                elif key == 'categories':
+                    self.import_categories(value)
+                elif key == 'goods':
+                    goods.append(value)
+                    if len(goods) >= self.batch_size:
+                        self.write_goods(goods, remaining)
+                        goods = []
+            if goods:
+                self.write_goods(goods, remaining)
+
+            if remaining:
+                self.stats['deleted'] = len(remaining)
+                for ids in chunked(remaining, self.batch_size):
+                    ProductInfo.objects.filter(id__in=ids).delete()
+
+            self.shop.is_uptodate = True
+            self.shop.save()
+        return self.stats
+
+    def write_goods(self, goods, remaining):
+        if self.incremental:
+            remaining.difference_update(self.update_goods(goods))
+        else:
+            self.create_goods(goods)
+
+        self.rows_processed += len(goods)
+        if self.progress is not None:
+            self.progress(self.rows_processed)
+
+    def import_categories(self, categories):
+        names = {category['id']: category['name'] for category in categories}
+        existing = set(Category.objects.filter(
+            id__in=names
+        ).values_list('id', flat=True))
+        Category.objects.bulk_create(
+            [Category(id=category_id, name=name)
+             for category_id, name in names.items()
+             if category_id not in existing],
+            batch_size=self.batch_size
+        )
+        self.shop.categories.add(*names)
+
+    def create_goods(self, goods):
+        products = self.get_product_ids(goods)
+        parameters = self.get_parameter_ids(goods)
+
+        product_infos = ProductInfo.objects.bulk_create(
+            [self.build_product_info(item, products) for item in goods],
+            batch_size=self.batch_size
+        )
+        self.set_product_info_ids(product_infos)
+        self.create_parameters(zip(product_infos, goods), parameters)
+        refresh_catalog([info.id for info in product_infos],
+                        batch_size=self.batch_size)
+        self.stats['created'] += len(product_infos)
+
+    def update_goods(self, goods):
+        """
+        Сравнивает пакет товаров с позициями магазина по external_id
+        и записывает только изменения. Позиции с совпадающим хэшем товара
+        пропускаются без сравнения полей и параметров.
+        Возвращает id сохраненных позиций.
+        """
+        existing = {}
+        for product_info in ProductInfo.objects.filter(
+            shop_id=self.shop.id,
+            external_id__in={item['id'] for item in goods}
+        ).order_by('id'):
+            existing.setdefault(product_info.external_id, product_info)
+
+        new_goods, modified = [], []
+        for item in goods:
+            product_info = existing.get(item['id'])
+            if product_info is None:
+                new_goods.append(item)
+            elif product_info.digest != get_item_digest(item):
+                modified.append((product_info, item))
+        self.stats['unchanged'] += len(existing) - len(modified)
+
+        if modified:
+            self.write_modified_goods(modified)
+        if new_goods:
+            self.create_goods(new_goods)
+        return {info.id for info in existing.values()}
+
+    def write_modified_goods(self, modified):
+        products = self.get_product_ids([item for _, item in modified])
+        parameters = self.get_parameter_ids([item for _, item in modified])
+
+        existing_parameters = {}
+        for product_info_id, parameter_id, value in \
+                ProductParameter.objects.filter(
+                    product_info_id__in=[info.id for info, _ in modified]
+                ).values_list('product_info_id', 'parameter_id', 'value'):
+            existing_parameters.setdefault(
+                product_info_id, {}
+            )[parameter_id] = value
+
+        changed, changed_parameters = [], []
+        for product_info, item in modified:
+            new_info = self.build_product_info(item, products)
+            is_changed = False
+            for field in self.UPDATE_FIELDS:
+                if getattr(product_info, field) != getattr(new_info, field):
+                    setattr(product_info, field, getattr(new_info, field))
+                    is_changed = True
+
+            new_parameters = {parameters[name]: str(value)
+                              for name, value in item['parameters'].items()}
+            if new_parameters != existing_parameters.get(product_info.id, {}):
+                changed_parameters.append((product_info, item))
+                is_changed = True
+
+            # хэш обновляется и у позиций без изменений данных,
+            # например загруженных до появления хэшей
+            product_info.digest = new_info.digest
+            if is_changed:
+                changed.append(product_info.id)
+                self.stats['updated'] += 1
+            else:
+                self.stats['unchanged'] += 1
+
+        ProductInfo.objects.bulk_update(
+            [info for info, _ in modified],
+            fields=self.UPDATE_FIELDS + ('digest',),
+            batch_size=self.batch_size
+        )
+        if changed_parameters:
+            ProductParameter.objects.filter(
+                product_info_id__in=[info.id for info, _ in changed_parameters]
+            ).delete()
+            self.create_parameters(changed_parameters, parameters)
+        if changed:
+            refresh_catalog(changed, batch_size=self.batch_size)
+
+    def build_product_info(self, item, products):
+        return ProductInfo(product_id=products[item['name'], item['category']],
+                           external_id=item['id'],
+                           model=item['model'],
+                           price=item['price'],
+                           price_rrc=item['price_rrc'],
+                           quantity=item['quantity'],
+                           shop_id=self.shop.id,
+                           digest=get_item_digest(item))
+
+    def create_parameters(self, product_infos_goods, parameters):
+        ProductParameter.objects.bulk_create(
+            [ProductParameter(product_info_id=product_info.id,
+                              parameter_id=parameters[name],
+                              value=str(value))
+             for product_info, item in product_infos_goods
+             for name, value in item['parameters'].items()],
+            batch_size=self.batch_size
+        )
+
+    def get_product_ids(self, goods):
+        """
+        Возвращает словарь (название, категория) -> id продукта,
+        создавая недостающие продукты
+        """
+        keys = {(item['name'], item['category']) for item in goods}
+        products = self.find_products(keys)
+        missing = keys.difference(products)
+        if missing:
+            Product.objects.bulk_create(
+                [Product(name=name, category_id=category_id)
+                 for name, category_id in missing],
+                batch_size=self.batch_size
+            )
+            products.update(self.find_products(missing))
+        return products
+
+    @staticmethod
+    def find_products(keys):
+        products = {}
+        queryset = Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys}
+        ).order_by('-id').values_list('name', 'category_id', 'id')
+        for name, category_id, product_id in queryset:
+            if (name, category_id) in keys:
+                products[name, category_id] = product_id
+        return products
+
+    def get_parameter_ids(self, goods):
+        """
+        Возвращает словарь имя параметра -> id,
+        создавая недостающие имена параметров
+        """
+        names = {name for item in goods for name in item['parameters']}
+        missing = names.difference(self.parameters)
+        if missing:
+            self.parameters.update(self.find_parameters(missing))
+            missing = missing.difference(self.parameters)
+        if missing:
+            Parameter.objects.bulk_create(
+                [Parameter(name=name) for name in missing],
+                batch_size=self.batch_size
+            )
+            self.parameters.update(self.find_parameters(missing))
+        return self.parameters
+
+    @staticmethod
+    def find_parameters(names):
+        return dict(Parameter.objects.filter(
+            name__in=names
+        ).order_by('-id').values_list('name', 'id'))
+
+    def set_product_info_ids(self, product_infos):
+        """
+        Проставляет id созданным объектам, если СУБД
+        не возвращает их из bulk_create (например, SQLite)
+        """
+        if not product_infos or product_infos[0].id is not None:
+            return
+        ids = {
+            (product_id, external_id): product_info_id
+            for product_id, external_id, product_info_id
+            in ProductInfo.objects.filter(
+                shop_id=self.shop.id,
+                external_id__in={info.external_id for info in product_infos}
+            ).values_list('product_id', 'external_id', 'id')
+        }
+        for product_info in product_infos:
+            product_info.id = ids[product_info.product_id,
+                                  product_info.external_id]
@@ -0,0 +1,359 @@
+import json
+import statistics
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings, \
+    setup_test_environment, teardown_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.cache import is_local_cache
+from backend.delivery import delivery_index
+from backend.models import Order, OrderItem, ProductInfo, Shop
+from backend.management.commands.seed_data import SEED_PASSWORD
+
+API = '/api/v1/'
+
+# user - 'buyer', 'shop' или None (без авторизации);
+# max_queries - допустимое количество запросов к базе;
+# scaled_path - тот же запрос с большим количеством строк в ответе,
+# количество запросов к базе у него должно совпадать (нет N+1);
+# setup - функция, выполняемая перед запросом в той же транзакции;
+# max_warm_queries - допустимое количество запросов к базе при повторном
+# запросе, когда кэши (токены, доставка, ответы каталога) заполнены;
+# проверяется только с общим кэшем (с кэшем в памяти процесса доставка
+# читается из базы при каждом запросе)
+Case = namedtuple('Case', ['name', 'method', 'path', 'data', 'user',
+                           'max_queries', 'status', 'scaled_path', 'setup',
+                           'format', 'max_warm_queries'],
+                  defaults=[None, None, None, (200,), None, None, 'json',
+                            None])
+
+
+def get_cases(fixtures):
+    buyer, shop = fixtures['buyer'], fixtures['shop']
+    address_id = fixtures['address_id']
+    basket_items = fixtures['basket_items']
+    product_info_ids = fixtures['product_info_ids']
+    category_id = fixtures['category_id']
+
+    def fill_stock():
+        ProductInfo.objects.filter(
+            id__in=[item.product_info_id for item in basket_items]
+        ).update(quantity=1000)
+
+    return [
+        Case('categories', 'get', 'categories/', max_queries=1),
+        Case('shops', 'get', 'shops/', max_queries=2),
+        Case('products', 'get', 'products/?limit=10', max_queries=1,
+             scaled_path='products/?limit=100'),
+        Case('products filtered', 'get',
+             'products/?ordering=-price&in_stock=true&limit=10',
+             max_queries=1,
+             scaled_path='products/?ordering=-price&in_stock=true&limit=100'),
+        Case('products search', 'get',
+             f'products/?search=1&category_id={category_id}&limit=10',
+             max_queries=1),
+        Case('products parameter', 'get',
+             'products/?parameter=Параметр 1:5&limit=10', max_queries=1),
+
+        Case('basket', 'get', 'basket/', user='buyer', max_queries=7,
+             max_warm_queries=4),
+        Case('basket add', 'post', 'basket/', user='buyer', max_queries=9,
+             data={'items': [{'product_info': product_info_id,
+                              'quantity': 1}
+                             for product_info_id in product_info_ids]}),
+        Case('basket update', 'put', 'basket/', user='buyer', max_queries=9,
+             data={'items': [{'id': item.id, 'quantity': item.quantity + 1}
+                             for item in basket_items]}),
+        Case('orders', 'get', 'order/?limit=5', user='buyer', max_queries=7,
+             max_warm_queries=4,
+             scaled_path='order/?limit=50'),
+        Case('orders by state', 'get', 'order/?state=new,sent&limit=5',
+             user='buyer', max_queries=7, max_warm_queries=4,
+             scaled_path='order/?state=new,sent&limit=50'),
+        Case('checkout', 'post', 'order/', user='buyer', max_queries=19,
+             data={'address_id': address_id}, setup=fill_stock),
+
+        # ответ содержит поле password, а хэш пароля не хранится в кэше
+        # токенов и читается из базы
+        Case('user details', 'get', 'user/details/', user='buyer',
+             max_queries=2, max_warm_queries=1),
+        Case('user details update', 'post', 'user/details/', user='buyer',
+             max_queries=4, data={'position': 'Закупщик'}),
+        Case('login', 'post', 'user/login/', max_queries=3,
+             data={'email': buyer.email, 'password': SEED_PASSWORD}),
+        Case('register', 'post', 'user/register/', max_queries=9,
+             status=(201,),
+             data={'first_name': 'Имя', 'last_name': 'Фамилия',
+                   'email': 'benchmark-new@example.com',
+                   'password': 'Benchmark-Pass-1', 'company': 'Компания',
+                   'position': 'Менеджер', 'phone': '+70000000000'}),
+        Case('register confirm', 'post', 'user/register/confirm/',
+             max_queries=6,
+             data={'email': buyer.email, 'token': 'invalid'},
+             status=(400,)),
+        Case('password reset', 'post', 'user/password_reset/',
+             max_queries=10, data={'email': buyer.email}),
+        Case('password reset confirm', 'post',
+             'user/password_reset/confirm/', max_queries=2,
+             data={'token': 'invalid', 'password': 'Benchmark-Pass-1'},
+             status=(404,)),
+
+        Case('addresses', 'get', 'user/addresses/', user='buyer',
+             max_queries=3),
+        Case('address create', 'post', 'user/addresses/', user='buyer',
+             max_queries=5, status=(201,),
+             data={'city': 'Москва', 'street': 'Тверская', 'house': '1'}),
+        Case('address', 'get', f'user/addresses/{address_id}/',
+             user='buyer', max_queries=3),
+        Case('address update', 'patch', f'user/addresses/{address_id}/',
+             user='buyer', max_queries=5, data={'house': '2'}),
+        Case('address delete', 'delete', f'user/addresses/{address_id}/',
+             user='buyer', max_queries=12, status=(204,)),
+
+        Case('partner register', 'post', 'partner/register/',
+             max_queries=10, status=(201,),
+             data={'first_name': 'Имя', 'last_name': 'Фамилия',
+                   'email': 'benchmark-shop@example.com',
+                   'password': 'Benchmark-Pass-1', 'company': 'Компания',
+                   'position': 'Менеджер', 'phone': '+70000000000'}),
+        Case('partner price list', 'post', 'partner/update/', user='shop',
+             max_queries=8, format='multipart',
+             data={'url': 'http://localhost/price_list.yaml'}),
+        Case('partner imports', 'get', 'partner/imports/', user='shop',
+             max_queries=3),
+        Case('partner state', 'get', 'partner/state/', user='shop',
+             max_queries=5),
+        Case('partner state update', 'post', 'partner/state/', user='shop',
+             max_queries=7, data={'state': 'on'}),
+        Case('partner orders', 'get', 'partner/orders/?limit=5',
+             user='shop', max_queries=6,
+             scaled_path='partner/orders/?limit=50'),
+        Case('partner delivery', 'get', 'partner/delivery/', user='shop',
+             max_queries=4),
+        Case('partner delivery update', 'post', 'partner/delivery/',
+             user='shop', max_queries=10,
+             data={'delivery': [{'min_sum': 0, 'cost': 300}]}),
+    ]
+
+
+def get_fixtures():
+    """
+    Покупатель с корзиной и адресом и поставщик с заказами
+    из заполненной базы (см. seed_data)
+    """
+    basket = Order.objects.filter(
+        state='basket', ordered_items__isnull=False,
+        user__addresses__isnull=False, user__is_active=True
+    ).select_related('user').order_by('id').first()
+    shop = Shop.objects.filter(
+        user__isnull=False, user__is_active=True,
+        product_infos__ordered_items__isnull=False
+    ).select_related('user').order_by('id').first()
+    if basket is None or shop is None:
+        raise CommandError('Нет данных для проверки, заполните базу '
+                           'командой seed_data')
+
+    basket_items = list(OrderItem.objects.filter(order_id=basket.id))
+    return {
+        'buyer': basket.user,
+        'shop': shop.user,
+        'address_id': basket.user.addresses.order_by('id').first().id,
+        'basket_items': basket_items,
+        'product_info_ids': list(ProductInfo.objects.exclude(
+            id__in=[item.product_info_id for item in basket_items]
+        ).order_by('id').values_list('id', flat=True)[:50]),
+        'category_id': shop.product_infos.order_by(
+            'id'
+        ).values_list('product__category_id', flat=True).first(),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Замер всех адресов API на большой заполненной базе '
+            '(seed_data): количество запросов к базе, время ответа '
+            'и размер ответа. Завершается ошибкой при превышении '
+            'допустимого количества запросов, N+1 (количество запросов '
+            'растет с размером страницы) или замедлении относительно '
+            'сохраненных результатов. Изменения в базе после каждого '
+            'запроса откатываются, кэши сервиса не используются. '
+            'Те же проверки количества запросов на небольшой тестовой '
+            'базе выполняют тесты (ApiQueryCountTest).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='повторов каждого запроса для замера '
+                                 'времени')
+        parser.add_argument('--baseline',
+                            help='JSON с результатами для сравнения')
+        parser.add_argument('--save',
+                            help='сохранить результаты в JSON')
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help='допустимое замедление относительно '
+                                 'baseline (доля)')
+        parser.add_argument('--min-delta', type=float, default=5,
+                            help='замедление меньше этого значения (мс) '
+                                 'не считается ошибкой')
+        parser.add_argument('--case', action='append',
+                            help='проверить только указанные запросы')
+
+    def handle(self, *args, **options):
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+        setup_test_environment()
+        # кэши очищаются перед каждым запросом, поэтому на время проверки
+        # используются собственные кэши в памяти процесса, а не общие
+        # кэши сервиса (Redis)
+        private_caches = override_settings(CACHES={
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': f'benchmark-{alias}'}
+            for alias in settings.CACHES
+        })
+        private_caches.enable()
+        try:
+            fixtures = get_fixtures()
+            clients = self.get_clients(fixtures)
+
+            results, errors = {}, []
+            for case in get_cases(fixtures):
+                if options['case'] and case.name not in options['case']:
+                    continue
+                result = self.run_case(case, clients[case.user],
+                                       options['repeat'])
+                results[case.name] = result
+                case_errors = self.check_result(case, result,
+                                                baseline.get(case.name),
+                                                options)
+                errors.extend(f"{case.name}: {error}"
+                              for error in case_errors)
+                self.write_result(case, result, case_errors)
+        finally:
+            private_caches.disable()
+            teardown_test_environment()
+
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+        if errors:
+            raise CommandError('\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Проверка пройдена'))
+
+    @staticmethod
+    def get_clients(fixtures):
+        """
+        Клиенты API: без авторизации (None), покупатель и поставщик
+        """
+        clients = {None: APIClient()}
+        for user_type in ('buyer', 'shop'):
+            token, _ = Token.objects.get_or_create(user=fixtures[user_type])
+            clients[user_type] = APIClient()
+            clients[user_type].credentials(
+                HTTP_AUTHORIZATION=f'Token {token.key}'
+            )
+        return clients
+
+    def run_case(self, case, client, repeat):
+        """
+        Первый запрос выполняется с пустым кэшем и по нему считаются
+        запросы к базе, затем запрос повторяется repeat раз для замера
+        времени, по первому повтору считаются запросы с заполненным кэшем
+        """
+        self.clear_caches()
+        response, queries = self.request(case, client, case.path)
+        durations, warm_queries = [], None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _, repeat_queries = self.request(case, client, case.path)
+            durations.append((time.perf_counter() - started) * 1000)
+            if warm_queries is None:
+                warm_queries = len(repeat_queries)
+
+        result = {
+            'status': response.status_code,
+            'queries': len(queries),
+            'warm_queries': warm_queries,
+            'size': len(response.content),
+            'cold_ms': round(queries.duration * 1000, 2),
+            'median_ms': round(statistics.median(durations), 2)
+            if durations else None,
+        }
+        if case.scaled_path:
+            self.clear_caches()
+            _, scaled_queries = self.request(case, client, case.scaled_path)
+            result['scaled_queries'] = len(scaled_queries)
+        return result
+
+    @staticmethod
+    def clear_caches():
+        for cache in caches.all():
+            cache.clear()
+        delivery_index.clear()
+
+    @staticmethod
+    def request(case, client, path):
+        """
+        Выполняет запрос и откатывает его изменения в базе
+        """
+        with transaction.atomic():
+            if case.setup:
+                case.setup()
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, case.method)(
+                    API + path, case.data, format=case.format
+                )
+            queries.duration = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return response, queries
+
+    @staticmethod
+    def check_result(case, result, baseline, options):
+        errors = []
+        if result['status'] not in case.status:
+            errors.append(f"статус ответа {result['status']}")
+        if case.max_queries is not None \
+                and result['queries'] > case.max_queries:
+            errors.append(f"запросов к базе {result['queries']}, "
+                          f"допустимо {case.max_queries}")
+        if case.max_warm_queries is not None \
+                and not is_local_cache(settings.RESPONSE_CACHE_ALIAS) \
+                and result['warm_queries'] is not None \
+                and result['warm_queries'] > case.max_warm_queries:
+            errors.append(f"запросов к базе с кэшем {result['warm_queries']}, "
+                          f"допустимо {case.max_warm_queries}")
+        if 'scaled_queries' in result \
+                and result['scaled_queries'] != result['queries']:
+            errors.append(f"N+1: запросов к базе {result['queries']}, "
+                          f"с большей страницей {result['scaled_queries']}")
+        if baseline:
+            if result['queries'] > baseline['queries']:
+                errors.append(f"запросов к базе {result['queries']}, "
+                              f"было {baseline['queries']}")
+            if result['median_ms'] and baseline.get('median_ms'):
+                limit = baseline['median_ms'] * (1 + options['threshold'])
+                if result['median_ms'] > limit and \
+                        result['median_ms'] - baseline['median_ms'] \
+                        > options['min_delta']:
+                    errors.append(f"время {result['median_ms']} мс, "
+                                  f"было {baseline['median_ms']} мс")
+        return errors
+
+    def write_result(self, case, result, errors):
+        line = (f"{case.name:<28} {result['status']:>3} "
+                f"запросов {result['queries']:>3}"
+                f"/{result['warm_queries'] if result['warm_queries'] is not None else '-':<3} "
+                f"{result['median_ms']:>8} мс  {result['size']:>8} байт")
+        if errors:
+            self.stdout.write(self.style.ERROR(f"{line}  {'; '.join(errors)}"))
+        else:
+            self.stdout.write(line)
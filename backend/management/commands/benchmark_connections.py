@@ -0,0 +1,138 @@
+import statistics
+import threading
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import RequestFactory
+from rest_framework.authtoken.models import Token
+
+from backend.models import User
+from backend.throttling import get_user_ident, reset_throttles
+from orders.postgresql.base import DatabaseWrapper, close_pools
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность GET basket/ через '
+            'WSGI-обработчик без постоянных соединений с базой, '
+            'с постоянными соединениями (CONN_MAX_AGE) и с пулом '
+            'соединений. Запускать на PostgreSQL с данными seed_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='количество потоков (покупателей)')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='запросов в каждом потоке')
+        parser.add_argument('--pool-size', type=int, default=5,
+                            help='размер пула соединений')
+        parser.add_argument('--path', default='/api/v1/basket/')
+
+    def handle(self, *args, **options):
+        if not isinstance(connections[DEFAULT_DB_ALIAS], DatabaseWrapper):
+            raise CommandError('Нужна база PostgreSQL с ENGINE '
+                               '"orders.postgresql"')
+
+        users = list(User.objects.filter(type='buyer', is_active=True)
+                     .order_by('id')[:options['concurrency']])
+        if len(users) < options['concurrency']:
+            raise CommandError('Недостаточно покупателей, '
+                               'заполните базу командой seed_data')
+        tokens = [Token.objects.get_or_create(user=user)[0].key
+                  for user in users]
+
+        modes = [
+            ('без постоянных соединений',
+             {'CONN_MAX_AGE': 0, 'POOL': None}),
+            ('постоянные соединения',
+             {'CONN_MAX_AGE': 600, 'POOL': None}),
+            (f"пул из {options['pool_size']} соединений",
+             {'CONN_MAX_AGE': 0,
+              'POOL': {'MAX_SIZE': options['pool_size'], 'TIMEOUT': 30}}),
+        ]
+        settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+        saved = {key: settings_dict.get(key) for key in ('CONN_MAX_AGE',
+                                                         'POOL')}
+        results = []
+        try:
+            for name, mode in modes:
+                # потоки создают соединения с новыми настройками
+                connection.close()
+                settings_dict.update(mode)
+                self.reset_throttles(users)
+                result = self.run_mode(tokens, options['requests'],
+                                       options['path'])
+                close_pools()
+                results.append((name, result))
+                self.report(name, result, results[0][1])
+        finally:
+            connection.close()
+            settings_dict.update(saved)
+
+        errors = sum(result['errors'] for _, result in results)
+        if errors:
+            raise CommandError(f"Ошибочных ответов: {errors}")
+
+    @staticmethod
+    def reset_throttles(users):
+        for user in users:
+            reset_throttles(get_user_ident(user.pk))
+
+    @staticmethod
+    def run_mode(tokens, requests, path):
+        """
+        Запросы к WSGI-обработчику, как от сервера приложений: после
+        каждого ответа срабатывает request_finished, который закрывает
+        соединение или возвращает его в пул
+        """
+        handler = WSGIHandler()
+        latencies = [[] for _ in tokens]
+        errors = [0] * len(tokens)
+        barrier = threading.Barrier(len(tokens))
+
+        def start_response(status, headers):
+            pass
+
+        def worker(index, token):
+            environ = RequestFactory().get(
+                path, HTTP_AUTHORIZATION=f"Token {token}"
+            ).environ
+            barrier.wait()
+            try:
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    response = handler(dict(environ), start_response)
+                    b''.join(response)
+                    response.close()
+                    latencies[index].append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors[index] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(index, token))
+                   for index, token in enumerate(tokens)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(sum(latencies, []))
+        return {
+            'requests': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'median_ms': statistics.median(latencies) * 1000,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+            'errors': sum(errors),
+        }
+
+    def report(self, name, result, base):
+        self.stdout.write(
+            f"{name:30} {result['rps']:8.1f} запросов/с "
+            f"(x{result['rps'] / base['rps']:.2f}), "
+            f"медиана {result['median_ms']:.1f} мс, "
+            f"p95 {result['p95_ms']:.1f} мс, "
+            f"ошибок {result['errors']}"
+        )
@@ -0,0 +1,137 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from backend.models import CatalogEntry, Delivery, Order, OrderItem, \
+    Parameter, Product, ProductInfo, Shop
+
+
+def get_hot_queries():
+    """
+    Основные запросы API и загрузки прайс-листов:
+    список (название, таблица, индексы, queryset), где индексы - имена
+    (или начала имен) индексов, один из которых должен быть в плане
+    на PostgreSQL. Значения условий не важны - проверяется только план
+    выполнения.
+    """
+    queries = [
+        ('корзина пользователя', 'backend_order',
+         ('unique_user_basket', 'order_user_dt_idx'),
+         Order.objects.filter(user_id=1, state='basket')),
+        ('история заказов пользователя', 'backend_order',
+         ('order_user_dt_idx',),
+         Order.objects.filter(user_id=1).exclude(
+             state='basket'
+         ).order_by('-dt', '-id')[:51]),
+        ('заказы по статусу', 'backend_order', ('order_state_dt_idx',),
+         Order.objects.filter(state='new').order_by('-dt')[:50]),
+        ('позиции заказа', 'backend_orderitem',
+         ('unique_order_item', 'backend_orderitem_order_id_'),
+         OrderItem.objects.filter(order_id=1)),
+        ('уровни доставки магазинов', 'backend_delivery',
+         ('unique_shop_min_sum', 'backend_delivery_shop_id_'),
+         Delivery.objects.filter(
+             shop_id__in=[1, 2, 3]
+         ).order_by('shop_id', 'min_sum')),
+        ('активные магазины', 'backend_shop', ('shop_active_name_idx',),
+         Shop.objects.filter(state=True).order_by('-name')),
+        ('продукты при загрузке', 'backend_product',
+         ('product_name_category_idx',),
+         Product.objects.filter(name__in=['a', 'b'],
+                                category_id__in=[1, 2])),
+        ('имена параметров при загрузке', 'backend_parameter',
+         ('parameter_name_idx',),
+         Parameter.objects.filter(name__in=['a', 'b'])),
+        ('позиции магазина при загрузке', 'backend_productinfo',
+         ('backend_productinfo_shop_id_',),
+         ProductInfo.objects.filter(shop_id=1, external_id__in=[1, 2])),
+        ('каталог товаров', 'backend_catalogentry',
+         ('catalog_state_idx', 'backend_catalogentry_pkey'),
+         CatalogEntry.objects.filter(
+             shop_state=True
+         ).order_by('product_info_id')[:51]),
+        ('каталог товаров по цене', 'backend_catalogentry',
+         ('catalog_price_idx',),
+         CatalogEntry.objects.filter(
+             shop_state=True
+         ).order_by('price', 'product_info_id')[:51]),
+    ]
+    if connection.vendor == 'postgresql':
+        # на других базах отбор по параметрам идет через ProductParameter
+        queries.append(
+            ('каталог товаров по параметру', 'backend_catalogentry',
+             ('catalog_parameters_idx',),
+             CatalogEntry.objects.filter(
+                 parameters__contains=[{'parameter': 'a', 'value': 'b'}]
+             ))
+        )
+    return queries
+
+
+def explain(queryset):
+    """
+    План запроса. На PostgreSQL последовательное чтение и сортировка
+    отключаются, поэтому Seq Scan в плане означает, что подходящего
+    индекса нет, а сортировка - что нет индекса с нужным порядком,
+    даже если в таблицах мало строк.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+        return queryset.explain()
+
+
+def is_primary_key_order(queryset):
+    ordering = queryset.query.order_by
+    pk = queryset.model._meta.pk
+    return bool(ordering) and ordering[0].lstrip('-') in ('pk', pk.name,
+                                                          pk.attname)
+
+
+def get_full_scan(plan, table, queryset):
+    """
+    Строка плана с полным чтением таблицы table или None
+    """
+    if connection.vendor == 'postgresql':
+        pattern = rf'Seq Scan on {table}\b'
+    elif is_primary_key_order(queryset):
+        # SQLite читает таблицу в порядке первичного ключа по его дереву
+        return None
+    else:
+        # SQLite: SCAN без индекса, SEARCH и SCAN ... USING INDEX
+        # используют индекс
+        pattern = rf'\bSCAN (TABLE )?{table}\b(?! USING)'
+    match = re.search(rf'.*{pattern}.*', plan)
+    return match.group(0).strip() if match else None
+
+
+class Command(BaseCommand):
+    help = ('Проверяет планы выполнения (EXPLAIN) основных запросов: '
+            'завершается ошибкой, если запрос читает таблицу целиком '
+            'вместо использования индекса')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true',
+                            help='вывести планы запросов')
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, table, _, queryset in get_hot_queries():
+            plan = explain(queryset)
+            full_scan = get_full_scan(plan, table, queryset)
+            if full_scan:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f"{name}: полное чтение таблицы ({full_scan})"
+                ))
+            else:
+                self.stdout.write(f"{name}: индекс")
+            if options['plans']:
+                self.stdout.write(plan + '\n')
+
+        if failed:
+            raise CommandError(f"Запросы без индекса: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.authtoken.models import Token
+
+from backend.models import User
+from .benchmark_connections import Command as BenchmarkConnections
+
+PATHS = ['/api/v1/basket/', '/api/v1/order/?limit=10',
+         '/api/v1/products/?limit=10']
+
+
+class InFlight:
+    """
+    Количество одновременно обрабатываемых запросов и его максимум
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.current -= 1
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает один рабочий процесс WSGI (--threads потоков) '
+            'и ASGI с асинхронными представлениями: --clients клиентов '
+            'одновременно запрашивают корзину, заказы и каталог. Каждый '
+            'режим запускается в отдельном процессе. Нужны данные '
+            'seed_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50,
+                            help='одновременных клиентов (покупателей)')
+        parser.add_argument('--requests', type=int, default=30,
+                            help='запросов от каждого клиента')
+        parser.add_argument('--threads', type=int, default=10,
+                            help='потоков рабочего процесса WSGI')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='адрес запроса (можно несколько)')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'],
+                            help='выполнить только один режим в этом '
+                                 'процессе и вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(type='buyer', is_active=True)
+                     .order_by('id')[:options['clients']])
+        if len(users) < options['clients']:
+            raise CommandError('Недостаточно покупателей, '
+                               'заполните базу командой seed_data')
+        tokens = [Token.objects.get_or_create(user=user)[0].key
+                  for user in users]
+        paths = options['paths'] or PATHS
+
+        if options['mode']:
+            if settings.ASYNC_VIEWS != (options['mode'] == 'asgi'):
+                raise CommandError('ASYNC_VIEWS не соответствует режиму')
+            BenchmarkConnections.reset_throttles(users)
+            run = self.run_asgi if options['mode'] == 'asgi' \
+                else self.run_wsgi
+            self.stdout.write(json.dumps(
+                run(tokens, paths, options['requests'], options['threads'])
+            ))
+            return
+
+        results = {mode: self.run_process(mode, options)
+                   for mode in ('wsgi', 'asgi')}
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode.upper()}: {result['rps']:8.1f} запросов/с, "
+                f"одновременно до {result['peak']} запросов, "
+                f"медиана {result['median_ms']:.1f} мс, "
+                f"p95 {result['p95_ms']:.1f} мс, "
+                f"ошибок {result['errors']}"
+            )
+        self.stdout.write(f"ASGI/WSGI: x"
+                          f"{results['asgi']['rps'] / results['wsgi']['rps']:.2f}")
+        if any(result['errors'] for result in results.values()):
+            raise CommandError('Есть ошибочные ответы')
+
+    @staticmethod
+    def run_process(mode, options):
+        """
+        Запускает режим в отдельном процессе: ASYNC_VIEWS читается
+        из окружения при загрузке настроек
+        """
+        command = [sys.executable, sys.argv[0], 'loadtest_asgi',
+                   '--mode', mode,
+                   '--clients', str(options['clients']),
+                   '--requests', str(options['requests']),
+                   '--threads', str(options['threads'])]
+        for path in options['paths'] or []:
+            command += ['--path', path]
+        environ = dict(os.environ,
+                       ASYNC_VIEWS='True' if mode == 'asgi' else 'False')
+        output = subprocess.run(command, env=environ, check=True,
+                                capture_output=True, text=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    @staticmethod
+    def get_result(latencies, errors, elapsed, in_flight):
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'median_ms': statistics.median(latencies) * 1000,
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+            'peak': in_flight.peak,
+            'errors': errors,
+        }
+
+    def run_wsgi(self, tokens, paths, requests, threads):
+        """
+        Рабочий процесс WSGI с threads потоками: клиент ждет свободный
+        поток, как в очереди сервера приложений
+        """
+        handler = WSGIHandler()
+        workers = threading.Semaphore(threads)
+        in_flight = InFlight()
+        latencies, errors = [], []
+        barrier = threading.Barrier(len(tokens))
+
+        def start_response(status, headers):
+            pass
+
+        def client(index, token):
+            barrier.wait()
+            for request_index in range(requests):
+                environ = RequestFactory().get(
+                    paths[(index + request_index) % len(paths)],
+                    HTTP_AUTHORIZATION=f"Token {token}"
+                ).environ
+                started = time.perf_counter()
+                with workers, in_flight:
+                    response = handler(environ, start_response)
+                    b''.join(response)
+                    response.close()
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        clients = [threading.Thread(target=client, args=(index, token))
+                   for index, token in enumerate(tokens)]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return self.get_result(latencies, len(errors),
+                               time.perf_counter() - started, in_flight)
+
+    def run_asgi(self, tokens, paths, requests, threads):
+        """
+        Рабочий процесс ASGI: все клиенты обслуживаются одним циклом
+        событий
+        """
+        application = get_asgi_application()
+        in_flight = InFlight()
+        latencies, errors = [], []
+
+        async def call(path, token):
+            url = urlsplit(path)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': url.path, 'raw_path': url.path.encode(),
+                'query_string': url.query.encode(), 'root_path': '',
+                'headers': [(b'host', b'testserver'),
+                            (b'authorization', f"Token {token}".encode())],
+                'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+            }
+            status = None
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'',
+                        'more_body': False}
+
+            async def send(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+
+            with in_flight:
+                await application(scope, receive, send)
+            return status
+
+        async def client(index, token):
+            for request_index in range(requests):
+                started = time.perf_counter()
+                status = await call(paths[(index + request_index)
+                                          % len(paths)], token)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    errors.append(status)
+
+        async def run():
+            await asyncio.gather(*(client(index, token)
+                                   for index, token in enumerate(tokens)))
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        return self.get_result(latencies, len(errors),
+                               time.perf_counter() - started, in_flight)
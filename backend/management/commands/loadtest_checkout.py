@@ -0,0 +1,142 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from backend.basket import CheckoutError, place_order
+from backend.catalog import refresh_catalog
+from backend.models import Address, Category, Delivery, Order, OrderItem, \
+    Product, ProductInfo, Shop, User
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочная проверка оформления заказов: много покупателей '
+            'одновременно заказывают один товар с ограниченным остатком. '
+            'Проверяет, что товар не продается сверх остатка, и выводит '
+            'пропускную способность. Тестовые данные удаляются после '
+            'проверки. Запускать на PostgreSQL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50,
+                            help='количество одновременных покупателей')
+        parser.add_argument('--stock', type=int, default=20,
+                            help='начальный остаток товара')
+        parser.add_argument('--quantity', type=int, default=1,
+                            help='количество товара в каждой корзине')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError('SQLite не поддерживает одновременную '
+                               'запись, используйте PostgreSQL')
+
+        buyers, stock = options['buyers'], options['stock']
+        quantity = options['quantity']
+        prefix = f"loadtest-{uuid.uuid4().hex[:8]}"
+
+        product_info, users = self.create_data(prefix, buyers, stock,
+                                               quantity)
+        try:
+            results, elapsed = self.run_checkouts(users)
+            self.report(results, elapsed, product_info, buyers, stock,
+                        quantity)
+        finally:
+            self.delete_data(prefix, product_info)
+
+    def create_data(self, prefix, buyers, stock, quantity):
+        with transaction.atomic():
+            shop_user = User.objects.create_user(f"{prefix}-shop@example.com",
+                                                 type='shop', is_active=True)
+            shop = Shop.objects.create(name=prefix, user=shop_user)
+            Delivery.objects.create(shop=shop, min_sum=0, cost=0)
+            category = Category.objects.create(name=prefix)
+            product = Product.objects.create(name=prefix, category=category)
+            product_info = ProductInfo.objects.create(
+                product=product, shop=shop, external_id=0, model=prefix,
+                quantity=stock, price=100, price_rrc=100
+            )
+            refresh_catalog([product_info.id])
+
+            users = []
+            for index in range(buyers):
+                user = User.objects.create_user(
+                    f"{prefix}-{index}@example.com", is_active=True
+                )
+                address = Address.objects.create(user=user, city=prefix,
+                                                  street=prefix)
+                order = Order.objects.create(user=user, state='basket')
+                OrderItem.objects.create(order=order,
+                                         product_info=product_info,
+                                         quantity=quantity)
+                users.append((user.id, address.id))
+        return product_info, users
+
+    @staticmethod
+    def run_checkouts(users):
+        """
+        Запускает оформление заказов в отдельных потоках одновременно
+        и возвращает список (результат, время в секундах) и общее время
+        """
+        results = [None] * len(users)
+        barrier = threading.Barrier(len(users))
+
+        def checkout(index, user_id, address_id):
+            barrier.wait()
+            started = time.perf_counter()
+            try:
+                place_order(user_id, address_id)
+                result = 'ok'
+            except CheckoutError:
+                result = 'rejected'
+            except Exception as error:
+                result = f"error: {error}"
+            finally:
+                connection.close()
+            results[index] = (result, time.perf_counter() - started)
+
+        threads = [threading.Thread(target=checkout, args=(index, *user))
+                   for index, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def report(self, results, elapsed, product_info, buyers, stock,
+               quantity):
+        product_info.refresh_from_db()
+        placed = Order.objects.filter(
+            ordered_items__product_info=product_info, state='new'
+        ).count()
+        ok = sum(result == 'ok' for result, _ in results)
+        rejected = sum(result == 'rejected' for result, _ in results)
+        errors = [result for result, _ in results
+                  if result not in ('ok', 'rejected')]
+        latencies = sorted(duration for _, duration in results)
+
+        self.stdout.write(
+            f"Покупателей: {buyers}, остаток: {stock}, в корзине: {quantity}\n"
+            f"Оформлено: {ok}, отклонено: {rejected}, ошибок: {len(errors)}\n"
+            f"Остаток после проверки: {product_info.quantity}\n"
+            f"Время: {elapsed:.3f} с, "
+            f"{buyers / elapsed:.1f} заказов в секунду, "
+            f"медиана {latencies[len(latencies) // 2] * 1000:.1f} мс"
+        )
+        for error in errors[:5]:
+            self.stderr.write(error)
+
+        expected = min(buyers, stock // quantity)
+        if errors or ok != expected or placed != ok \
+                or product_info.quantity != stock - ok * quantity:
+            raise CommandError(f"Ожидалось заказов: {expected}, "
+                               f"оформлено: {ok}, в базе: {placed}")
+        self.stdout.write(self.style.SUCCESS('Проверка пройдена'))
+
+    @staticmethod
+    def delete_data(prefix, product_info):
+        with transaction.atomic():
+            User.objects.filter(email__startswith=prefix).delete()
+            Category.objects.filter(id=product_info.product.category_id) \
+                .delete()
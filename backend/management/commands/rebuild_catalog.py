@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.catalog import refresh_catalog
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает денормализованный каталог товаров'
+
+    def handle(self, *args, **options):
+        refresh_catalog()
+        self.stdout.write(self.style.SUCCESS('Каталог пересобран'))
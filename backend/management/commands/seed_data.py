@@ -0,0 +1,223 @@
+import datetime
+import random
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from backend.catalog import refresh_catalog
+from backend.models import Address, Category, Delivery, Order, OrderItem, \
+    Parameter, Product, ProductInfo, ProductParameter, Shop, User, \
+    STATE_CHOICES
+from backend.utils import chunked
+
+# пароль всех созданных пользователей
+SEED_PASSWORD = 'benchmark'
+SEED_EMAIL_DOMAIN = 'seed.example.com'
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу случайными данными для нагрузочных проверок: '
+            'магазины с прайс-листами, покупатели с историей заказов '
+            'и корзинами. Пароль пользователей - "benchmark".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=1000)
+        parser.add_argument('--goods', type=int, default=1000,
+                            help='позиций в прайс-листе магазина')
+        parser.add_argument('--products', type=int, default=10000,
+                            help='различных продуктов')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--parameters', type=int, default=20,
+                            help='различных имен параметров')
+        parser.add_argument('--buyers', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=50,
+                            help='заказов у каждого покупателя')
+        parser.add_argument('--items', type=int, default=3,
+                            help='позиций в заказе')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='начальное значение генератора')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = settings.IMPORT_BATCH_SIZE
+        self.password = make_password(SEED_PASSWORD)
+
+        with transaction.atomic():
+            category_ids = self.create_categories(options['categories'])
+            parameter_ids = self.create_parameters(options['parameters'])
+            product_ids = self.create_products(options['products'],
+                                               category_ids)
+            shop_ids = self.create_shops(options['shops'], category_ids)
+            product_info_ids = self.create_product_infos(
+                shop_ids, options['goods'], product_ids, parameter_ids
+            )
+            self.create_buyers(options['buyers'], options['orders'],
+                               options['items'], product_info_ids)
+            self.reset_sequences()
+            refresh_catalog()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: магазинов {len(shop_ids)}, "
+            f"позиций {len(product_info_ids)}, "
+            f"покупателей {options['buyers']} "
+            f"по {options['orders']} заказов"
+        ))
+
+    def insert(self, model, objects):
+        for objects_chunk in chunked(objects, self.batch_size):
+            model.objects.bulk_create(objects_chunk)
+
+    @staticmethod
+    def get_ids(model, count):
+        """
+        id для новых объектов: задаются явно, чтобы не запрашивать их
+        после bulk_create (SQLite их не возвращает)
+        """
+        start = (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        return range(start, start + count)
+
+    def create_categories(self, count):
+        ids = self.get_ids(Category, count)
+        self.insert(Category, (Category(id=category_id,
+                                        name=f"Категория {category_id}")
+                               for category_id in ids))
+        return ids
+
+    def create_parameters(self, count):
+        ids = self.get_ids(Parameter, count)
+        self.insert(Parameter, (Parameter(id=parameter_id,
+                                          name=f"Параметр {parameter_id}")
+                                for parameter_id in ids))
+        return ids
+
+    def create_products(self, count, category_ids):
+        ids = self.get_ids(Product, count)
+        self.insert(Product, (
+            Product(id=product_id, name=f"Продукт {product_id}",
+                    category_id=self.random.choice(category_ids))
+            for product_id in ids
+        ))
+        return ids
+
+    def create_user(self, user_id, user_type):
+        return User(id=user_id, email=f"{user_type}{user_id}@"
+                                      f"{SEED_EMAIL_DOMAIN}",
+                    password=self.password, type=user_type, is_active=True,
+                    first_name='Имя', last_name=f"Фамилия {user_id}",
+                    company=f"Компания {user_id}", phone='+70000000000')
+
+    def create_shops(self, count, category_ids):
+        user_ids = self.get_ids(User, count)
+        self.insert(User, (self.create_user(user_id, 'shop')
+                           for user_id in user_ids))
+
+        ids = self.get_ids(Shop, count)
+        self.insert(Shop, (Shop(id=shop_id, name=f"Магазин {shop_id}",
+                                user_id=user_id, is_uptodate=True)
+                           for shop_id, user_id in zip(ids, user_ids)))
+        self.insert(Delivery, (
+            Delivery(shop_id=shop_id, min_sum=min_sum, cost=cost)
+            for shop_id in ids
+            for min_sum, cost in ((0, 500), (10000, 0))
+        ))
+        self.insert(Category.shops.through, (
+            Category.shops.through(shop_id=shop_id, category_id=category_id)
+            for shop_id in ids
+            for category_id in self.random.sample(
+                category_ids, min(5, len(category_ids))
+            )
+        ))
+        return ids
+
+    def create_product_infos(self, shop_ids, goods, product_ids,
+                             parameter_ids):
+        ids = self.get_ids(ProductInfo, len(shop_ids) * goods)
+        shop_goods = ((shop_id, external_id)
+                      for shop_id in shop_ids
+                      for external_id in range(goods))
+        self.insert(ProductInfo, (
+            ProductInfo(id=product_info_id, shop_id=shop_id,
+                        external_id=external_id,
+                        product_id=self.random.choice(product_ids),
+                        model=f"model-{external_id}",
+                        quantity=self.random.randint(0, 100),
+                        price=self.random.randint(100, 100000),
+                        price_rrc=self.random.randint(100, 100000))
+            for product_info_id, (shop_id, external_id)
+            in zip(ids, shop_goods)
+        ))
+        self.insert(ProductParameter, (
+            ProductParameter(product_info_id=product_info_id,
+                             parameter_id=parameter_id,
+                             value=str(self.random.randint(1, 10)))
+            for product_info_id in ids
+            for parameter_id in self.random.sample(
+                parameter_ids, min(2, len(parameter_ids))
+            )
+        ))
+        return ids
+
+    def create_buyers(self, count, orders, items, product_info_ids):
+        user_ids = self.get_ids(User, count)
+        self.insert(User, (self.create_user(user_id, 'buyer')
+                           for user_id in user_ids))
+
+        address_ids = self.get_ids(Address, count)
+        self.insert(Address, (
+            Address(id=address_id, user_id=user_id, city='Москва',
+                    street=f"Улица {user_id}", house='1')
+            for address_id, user_id in zip(address_ids, user_ids)
+        ))
+
+        # заказы и корзина (последний заказ) каждого покупателя
+        states = [state for state, _ in STATE_CHOICES if state != 'basket']
+        order_ids = self.get_ids(Order, count * (orders + 1))
+        order_users = ((user_id, address_id, index)
+                       for user_id, address_id in zip(user_ids, address_ids)
+                       for index in range(orders + 1))
+        now = timezone.now()
+        for chunk in chunked(zip(order_ids, order_users), self.batch_size):
+            new_orders = [
+                Order(id=order_id, user_id=user_id,
+                      state=(self.random.choice(states) if index < orders
+                             else 'basket'),
+                      address_id=address_id if index < orders else None)
+                for order_id, (user_id, address_id, index) in chunk
+            ]
+            Order.objects.bulk_create(new_orders)
+            # дата создания задается после вставки: auto_now_add
+            # заменяет её текущим временем
+            for order in new_orders:
+                order.dt = now - datetime.timedelta(
+                    minutes=self.random.randint(0, 365 * 24 * 60)
+                )
+            Order.objects.bulk_update(new_orders, fields=['dt'])
+
+            self.insert(OrderItem, (
+                OrderItem(order_id=order.id, product_info_id=product_info_id,
+                          quantity=self.random.randint(1, 5))
+                for order in new_orders
+                for product_info_id in self.random.sample(
+                    product_info_ids, min(items, len(product_info_ids))
+                )
+            ))
+
+    @staticmethod
+    def reset_sequences():
+        """
+        Сдвигает последовательности id PostgreSQL после вставки
+        с явными id
+        """
+        statements = connection.ops.sequence_reset_sql(
+            no_style(),
+            [User, Shop, Category, Parameter, Product, ProductInfo, Address,
+             Order]
+        )
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from backend.tasks import dispatch_emails_task, send_admin_digests_task
+
+
+class Command(BaseCommand):
+    help = 'Отправляет сводки уведомлений администратора, окно которых ' \
+           'истекло, и письма из очереди, время повторной отправки ' \
+           'которых наступило'
+
+    def handle(self, *args, **options):
+        digests = send_admin_digests_task()
+        sent = dispatch_emails_task()
+        self.stdout.write(self.style.SUCCESS(
+            f'Отправлено сводок: {digests}, писем: {sent}'
+        ))
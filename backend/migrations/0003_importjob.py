@@ -0,0 +1,34 @@
+# Generated by Django 3.2.15 on 2026-10-17 14:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_remove_user_patronymic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершено'), ('failed', 'Ошибка')], default='pending', max_length=15, verbose_name='Статус')),
+                ('incremental', models.BooleanField(default=True, verbose_name='Инкрементальная загрузка')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Обработано позиций')),
+                ('stats', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('errors', models.TextField(blank=True, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало загрузки')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание загрузки')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Загрузка прайс-листа',
+                'verbose_name_plural': 'Список загрузок прайс-листов',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.15 on 2026-10-17 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='file',
+            field=models.FileField(blank=True, null=True, upload_to='import_jobs/', verbose_name='Загруженный прайс-лист'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='url_etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='url_last_modified',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Last-Modified'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='url_etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='url_last_modified',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Last-Modified прайс-листа'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершено'), ('skipped', 'Без изменений'), ('failed', 'Ошибка')], default='pending', max_length=15, verbose_name='Статус'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.15 on 2026-10-17 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_price_list_fetch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш позиции прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='price_list_digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш загруженного прайс-листа'),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 3.2.15 on 2026-10-17 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+TRIGRAM_INDEXES = (
+    ('catalog_product_name_trgm_idx', 'backend_catalogentry', 'product_name'),
+    ('catalog_model_trgm_idx', 'backend_catalogentry', 'model'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+FILL_BATCH_SIZE = 1000
+
+
+def build_catalog_entry(CatalogEntry, info):
+    return CatalogEntry(
+        product_info_id=info.id,
+        external_id=info.external_id,
+        model=info.model,
+        product_name=info.product.name,
+        category_id=info.product.category_id,
+        category_name=info.product.category.name,
+        shop_id=info.shop_id,
+        shop_name=info.shop.name,
+        shop_state=info.shop.state,
+        shop_delivery=[
+            {'min_sum': delivery.min_sum, 'cost': delivery.cost}
+            for delivery in sorted(info.shop.delivery.all(),
+                                   key=lambda delivery: delivery.min_sum)
+        ],
+        quantity=info.quantity,
+        price=info.price,
+        price_rrc=info.price_rrc,
+        parameters=[
+            {'parameter': parameter.parameter.name,
+             'value': parameter.value}
+            for parameter in info.product_parameters.all()
+        ],
+    )
+
+
+def fill_catalog(apps, schema_editor):
+    """
+    Заполняем каталог по уже загруженным прайс-листам пакетами
+    по FILL_BATCH_SIZE позиций, чтобы не держать в памяти всю таблицу
+    """
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    CatalogEntry = apps.get_model('backend', 'CatalogEntry')
+    last_id = 0
+    while True:
+        ids = list(ProductInfo.objects.filter(
+            id__gt=last_id
+        ).order_by('id').values_list('id', flat=True)[:FILL_BATCH_SIZE])
+        if not ids:
+            return
+        last_id = ids[-1]
+        product_infos = ProductInfo.objects.filter(
+            id__in=ids
+        ).select_related(
+            'shop', 'product__category'
+        ).prefetch_related(
+            'shop__delivery', 'product_parameters__parameter'
+        )
+        CatalogEntry.objects.bulk_create(
+            [build_catalog_entry(CatalogEntry, info)
+             for info in product_infos],
+            batch_size=FILL_BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('product_info', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='backend.productinfo', verbose_name='Информация о продукте')),
+                ('external_id', models.PositiveIntegerField(verbose_name='Внешний ИД')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('product_name', models.CharField(max_length=80, verbose_name='Продукт')),
+                ('category_name', models.CharField(max_length=40, verbose_name='Категория')),
+                ('shop_name', models.CharField(max_length=50, verbose_name='Магазин')),
+                ('shop_state', models.BooleanField(verbose_name='статус получения заказов')),
+                ('shop_delivery', models.JSONField(default=list, verbose_name='Стоимость доставки')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')),
+                ('parameters', models.JSONField(default=list, verbose_name='Параметры')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='backend.category', verbose_name='Категория')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Запись каталога',
+                'verbose_name_plural': 'Каталог',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['shop_state', 'product_info'], name='catalog_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['price', 'product_info'], name='catalog_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['product_name', 'product_info'], name='catalog_product_name_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.15 on 2026-10-17 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_outbox_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdminNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('new_order', 'Новые заказы'), ('price_list', 'Обновления прайс-листов')], max_length=15, verbose_name='Событие')),
+                ('message', models.TextField(verbose_name='Текст')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки сводки')),
+            ],
+            options={
+                'verbose_name': 'Уведомление администратора',
+                'verbose_name_plural': 'Список уведомлений администратора',
+                'ordering': ('created_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='adminnotification',
+            index=models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['event', 'created_at'], name='admin_notification_unsent_idx'),
+        ),
+    ]
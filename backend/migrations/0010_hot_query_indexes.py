@@ -0,0 +1,76 @@
+# Generated by Django 3.2.15 on 2026-10-17 14:29
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_baskets(apps, schema_editor):
+    """
+    Объединяет лишние корзины пользователей в самую раннюю
+    перед созданием ограничения unique_user_basket
+    """
+    Order = apps.get_model('backend', 'Order')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+
+    user_ids = Order.objects.filter(
+        state='basket'
+    ).order_by().values('user_id').annotate(
+        count=Count('id')
+    ).filter(count__gt=1).values_list('user_id', flat=True)
+
+    for user_id in user_ids:
+        kept, *extra = Order.objects.filter(
+            user_id=user_id, state='basket'
+        ).order_by('id')
+        items = {item.product_info_id: item
+                 for item in OrderItem.objects.filter(order_id=kept.id)}
+        for item in OrderItem.objects.filter(
+            order_id__in=[basket.id for basket in extra]
+        ).order_by('id'):
+            if item.product_info_id in items:
+                items[item.product_info_id].quantity += item.quantity
+                items[item.product_info_id].save(update_fields=['quantity'])
+            else:
+                item.order_id = kept.id
+                item.save(update_fields=['order'])
+                items[item.product_info_id] = item
+        Order.objects.filter(id__in=[basket.id for basket in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_admin_notification'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_name_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-dt', '-id'], name='order_user_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['state', '-dt'], name='order_state_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameter',
+            index=models.Index(fields=['name'], name='parameter_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'category'], name='product_name_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(condition=models.Q(('state', True)), fields=['-name'], name='shop_active_name_idx'),
+        ),
+        migrations.RunPython(merge_baskets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('state', 'basket')), fields=('user',), name='unique_user_basket'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_parameters_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # индекс для отбора по параметрам (parameters @> ...)
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS catalog_parameters_idx '
+        'ON backend_catalogentry USING gin (parameters jsonb_path_ops)'
+    )
+
+
+def drop_parameters_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS catalog_parameters_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_parameters_index, drop_parameters_index),
+    ]
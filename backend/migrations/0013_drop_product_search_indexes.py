@@ -0,0 +1,42 @@
+# Generated by Django 3.2.15 on 2026-10-17 16:05
+
+from django.db import migrations, models
+
+# Поиск и сортировка списка товаров выполняются по CatalogEntry,
+# индексы 0006 только замедляют загрузку прайс-листов
+TRIGRAM_INDEXES = (
+    ('product_name_trgm_idx', 'backend_product', 'name'),
+    ('product_info_model_trgm_idx', 'backend_productinfo', 'model'),
+)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_outbox_email_sending'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productinfo',
+            name='product_info_price_idx',
+        ),
+        migrations.RunPython(drop_trigram_indexes, create_trigram_indexes),
+    ]
@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import close_old_connections, connection, models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -20,6 +23,26 @@ USER_TYPE_CHOICES = (
     ('buyer', 'Покупатель'),
 )
 
+IMPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершено'),
+    ('skipped', 'Без изменений'),
+    ('failed', 'Ошибка'),
+)
+
+EMAIL_STATE_CHOICES = (
+    ('pending', 'Ожидает отправки'),
+    ('sending', 'Отправляется'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Не отправлено'),
+)
+
+ADMIN_EVENT_CHOICES = (
+    ('new_order', 'Новые заказы'),
+    ('price_list', 'Обновления прайс-листов'),
+)
+
 
 # Create your models here.
 
@@ -122,11 +145,28 @@ class Shop(models.Model):
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов',
                                 default=True)
+    # заголовки последней загрузки по ссылке для условных запросов
+    url_etag = models.CharField(verbose_name='ETag прайс-листа',
+                                max_length=200, blank=True)
+    url_last_modified = models.CharField(
+        verbose_name='Last-Modified прайс-листа',
+        max_length=50,
+        blank=True
+    )
+    price_list_digest = models.CharField(
+        verbose_name='Хэш загруженного прайс-листа',
+        max_length=64,
+        blank=True
+    )
 
     class Meta:
         verbose_name = 'Магазин'
         verbose_name_plural = "Список магазинов"
         ordering = ('-name',)
+        indexes = [
+            models.Index(fields=['-name'], condition=models.Q(state=True),
+                         name='shop_active_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -160,6 +200,10 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = "Список продуктов"
         ordering = ('-name',)
+        indexes = [
+            models.Index(fields=['name', 'category'],
+                         name='product_name_category_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -183,6 +227,8 @@ class ProductInfo(models.Model):
     price_rrc = models.PositiveIntegerField(
         verbose_name='Рекомендуемая розничная цена'
     )
+    digest = models.CharField(verbose_name='Хэш позиции прайс-листа',
+                              max_length=64, blank=True)
 
     class Meta:
         verbose_name = 'Информация о продукте'
@@ -203,6 +249,9 @@ class Parameter(models.Model):
         verbose_name = 'Имя параметра'
         verbose_name_plural = "Список имен параметров"
         ordering = ('-name',)
+        indexes = [
+            models.Index(fields=['name'], name='parameter_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -228,11 +277,67 @@ class ProductParameter(models.Model):
             models.UniqueConstraint(fields=['product_info', 'parameter'],
                                     name='unique_product_parameter'),
         ]
+        indexes = [
+            models.Index(fields=['parameter', 'value'],
+                         name='product_parameter_value_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product_info}: {self.parameter}"
 
 
+class CatalogEntry(models.Model):
+    """
+    Денормализованная запись каталога: информация о продукте вместе
+    с продуктом, категорией, магазином, его доставкой и параметрами.
+    Обновляется при загрузке прайс-листов и изменении магазинов
+    (см. backend.catalog).
+    """
+    product_info = models.OneToOneField(ProductInfo,
+                                        verbose_name='Информация о продукте',
+                                        related_name='catalog_entry',
+                                        primary_key=True,
+                                        on_delete=models.CASCADE)
+    external_id = models.PositiveIntegerField(verbose_name='Внешний ИД')
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    product_name = models.CharField(max_length=80, verbose_name='Продукт')
+    category = models.ForeignKey(Category,
+                                 verbose_name='Категория',
+                                 related_name='catalog_entries',
+                                 on_delete=models.CASCADE)
+    category_name = models.CharField(max_length=40,
+                                     verbose_name='Категория')
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='catalog_entries',
+                             on_delete=models.CASCADE)
+    shop_name = models.CharField(max_length=50, verbose_name='Магазин')
+    shop_state = models.BooleanField(verbose_name='статус получения заказов')
+    shop_delivery = models.JSONField(verbose_name='Стоимость доставки',
+                                     default=list)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(
+        verbose_name='Рекомендуемая розничная цена'
+    )
+    parameters = models.JSONField(verbose_name='Параметры', default=list)
+
+    class Meta:
+        verbose_name = 'Запись каталога'
+        verbose_name_plural = "Каталог"
+        indexes = [
+            models.Index(fields=['shop_state', 'product_info'],
+                         name='catalog_state_idx'),
+            models.Index(fields=['price', 'product_info'],
+                         name='catalog_price_idx'),
+            models.Index(fields=['product_name', 'product_info'],
+                         name='catalog_product_name_idx'),
+        ]
+
+    def __str__(self):
+        return self.product_name
+
+
 class Address(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              verbose_name='Пользователь',
@@ -281,6 +386,17 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказов"
         ordering = ('-dt',)
+        constraints = [
+            # у пользователя может быть только одна корзина
+            models.UniqueConstraint(fields=['user'],
+                                    condition=models.Q(state='basket'),
+                                    name='unique_user_basket'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-dt', '-id'],
+                         name='order_user_dt_idx'),
+            models.Index(fields=['state', '-dt'], name='order_state_dt_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ {self.id} от {self.dt}"
@@ -336,6 +452,151 @@ class Delivery(models.Model):
                 f"стоимость доставки {self.cost}")
 
 
+class ImportJob(models.Model):
+    shop = models.ForeignKey(Shop,
+                             verbose_name='Магазин',
+                             related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    state = models.CharField(verbose_name='Статус',
+                             choices=IMPORT_STATE_CHOICES,
+                             max_length=15,
+                             default='pending')
+    incremental = models.BooleanField(verbose_name='Инкрементальная загрузка',
+                                      default=True)
+    file = models.FileField(upload_to='import_jobs/',
+                            verbose_name='Загруженный прайс-лист',
+                            null=True,
+                            blank=True)
+    url_etag = models.CharField(verbose_name='ETag', max_length=200,
+                                blank=True)
+    url_last_modified = models.CharField(verbose_name='Last-Modified',
+                                         max_length=50, blank=True)
+    digest = models.CharField(verbose_name='Хэш прайс-листа', max_length=64,
+                              blank=True)
+    rows_processed = models.PositiveIntegerField(
+        verbose_name='Обработано позиций',
+        default=0
+    )
+    stats = models.JSONField(verbose_name='Результат', default=dict,
+                             blank=True)
+    errors = models.TextField(verbose_name='Ошибки', blank=True)
+    created_at = models.DateTimeField(verbose_name='Дата создания',
+                                      auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name='Начало загрузки',
+                                      null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name='Окончание загрузки',
+                                       null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайс-листа'
+        verbose_name_plural = "Список загрузок прайс-листов"
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f"Загрузка {self.id} прайс-листа {self.shop}"
+
+    def set_progress(self, rows_processed):
+        """
+        Сохраняет количество обработанных позиций в строке задания.
+        Загрузка выполняется в одной транзакции, и ее изменения не видны
+        другим процессам до завершения, поэтому прогресс записывается
+        в отдельном потоке - через отдельное соединение с базой.
+        """
+        self.rows_processed = rows_processed
+        if connection.in_atomic_block and connection.vendor != 'sqlite':
+            progress_executor.submit(save_progress_in_thread, self.id,
+                                     rows_processed).result()
+        else:
+            # SQLite блокирует запись из второго соединения до конца
+            # транзакции
+            save_progress(self.id, rows_processed)
+
+    @property
+    def duration(self):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or timezone.now()) - self.started_at
+
+
+# поток с собственным соединением для записи прогресса загрузок
+progress_executor = ThreadPoolExecutor(max_workers=1,
+                                       thread_name_prefix='import-progress')
+
+
+def save_progress(job_id, rows_processed):
+    ImportJob.objects.filter(id=job_id).update(rows_processed=rows_processed)
+
+
+def save_progress_in_thread(job_id, rows_processed):
+    close_old_connections()
+    save_progress(job_id, rows_processed)
+
+
+class OutboxEmail(models.Model):
+    """
+    Письмо в очереди на отправку. Обработчики запросов только сохраняют
+    письмо, отправку выполняет задача dispatch_emails_task.
+    У письма в статусе 'sending' next_attempt_at - окончание срока,
+    на который оно закреплено за отправляющим обработчиком.
+    """
+    title = models.CharField(verbose_name='Тема', max_length=255)
+    message = models.TextField(verbose_name='Текст')
+    sender = models.CharField(verbose_name='Отправитель', max_length=254)
+    recipients = models.JSONField(verbose_name='Получатели', default=list)
+    state = models.CharField(verbose_name='Статус',
+                             choices=EMAIL_STATE_CHOICES,
+                             max_length=15,
+                             default='pending')
+    attempts = models.PositiveIntegerField(verbose_name='Попыток отправки',
+                                           default=0)
+    next_attempt_at = models.DateTimeField(verbose_name='Следующая попытка',
+                                           default=timezone.now)
+    errors = models.TextField(verbose_name='Ошибки', blank=True)
+    created_at = models.DateTimeField(verbose_name='Дата создания',
+                                      auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name='Дата отправки',
+                                   null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = "Очередь исходящих писем"
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_at'],
+                         name='outbox_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} для {', '.join(self.recipients)}"
+
+
+class AdminNotification(models.Model):
+    """
+    Уведомление администратора, ожидающее отправки в сводке
+    """
+    event = models.CharField(verbose_name='Событие',
+                             choices=ADMIN_EVENT_CHOICES,
+                             max_length=15)
+    message = models.TextField(verbose_name='Текст')
+    created_at = models.DateTimeField(verbose_name='Дата создания',
+                                      auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name='Дата отправки сводки',
+                                   null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Уведомление администратора'
+        verbose_name_plural = "Список уведомлений администратора"
+        ordering = ('created_at',)
+        indexes = [
+            models.Index(fields=['event', 'created_at'],
+                         condition=models.Q(sent_at__isnull=True),
+                         name='admin_notification_unsent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_display()}: {self.message}"
+
+
 class ConfirmEmailToken(models.Model):
     class Meta:
         verbose_name = 'Токен подтверждения Email'
@@ -0,0 +1,108 @@
+import base64
+import binascii
+import json
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def get_model_field(model, path):
+    """
+    Поле модели по пути вида 'product__name'
+    """
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        model = field.related_model
+    return field
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (keyset pagination).
+
+    Следующая страница выбирается условием на поля сортировки последней
+    записи предыдущей страницы, а не смещением, поэтому время выборки
+    не зависит от номера страницы. Последнее поле сортировки должно быть
+    уникальным (обычно id).
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    invalid_cursor_message = 'Неправильный курсор'
+
+    def __init__(self, ordering=('-dt', '-id')):
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.get_keyset_filter(queryset.model, cursor)
+            )
+
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.last = page[-1] if page else None
+        return page
+
+    def get_keyset_filter(self, model, cursor):
+        """
+        Условие "запись после курсора" для сортировки self.ordering:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        values = self.decode_cursor(model, cursor)
+        query = Q()
+        for index, ordering in enumerate(self.ordering):
+            lookup = f"{self.fields[index]}__" \
+                     f"{'lt' if ordering.startswith('-') else 'gt'}"
+            condition = Q(**{lookup: values[index]})
+            for field, value in zip(self.fields[:index], values):
+                condition &= Q(**{field: value})
+            query |= condition
+        return query
+
+    def encode_cursor(self, instance):
+        values = [attrgetter(field.replace('__', '.'))(instance)
+                  for field in self.fields]
+        # str сохраняет микросекунды даты, в отличие от DjangoJSONEncoder
+        content = json.dumps(values, default=str)
+        return base64.urlsafe_b64encode(content.encode()).decode()
+
+    def decode_cursor(self, model, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [get_model_field(model, field).to_python(value)
+                    for field, value in zip(self.fields, values)]
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
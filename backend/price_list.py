@@ -0,0 +1,284 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests as rqs
+import yaml
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# поля товара в CSV, остальные колонки считаются параметрами
+CSV_INTEGER_FIELDS = ('id', 'category', 'price', 'price_rrc', 'quantity')
+CSV_FIELDS = CSV_INTEGER_FIELDS + ('model', 'name', 'category_name')
+
+FORMATS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.ndjson': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+# результат загрузки по ссылке; path равен None, если файл не изменился
+FetchResult = namedtuple('FetchResult',
+                         ['path', 'etag', 'last_modified', 'digest'])
+
+
+class PriceListError(Exception):
+    """
+    Прайс-лист магазина недоступен
+    """
+
+
+def get_request_error(error):
+    """
+    Ошибка загрузки прайс-листа по исключению requests или ввода-вывода
+    """
+    if isinstance(error, rqs.exceptions.Timeout):
+        return PriceListError('Превышено время ожидания')
+    if isinstance(error, rqs.exceptions.ConnectionError):
+        return PriceListError('Нет соединения')
+    if isinstance(error, (rqs.exceptions.InvalidURL,
+                          rqs.exceptions.MissingSchema,
+                          rqs.exceptions.InvalidSchema)):
+        return PriceListError('Неверная ссылка на прайс-лист')
+    return PriceListError(f'Ошибка загрузки прайс-листа: {error}')
+
+
+def get_format(name):
+    """
+    Определяет формат прайс-листа по расширению имени файла или ссылки.
+    По умолчанию прайс-лист считается YAML-файлом.
+    """
+    extension = os.path.splitext(name or '')[1].lower()
+    return FORMATS.get(extension, 'yaml')
+
+
+def read_price_list(stream, name=''):
+    """
+    Построчно читает прайс-лист из потока и возвращает итератор записей
+    (ключ, значение), где ключ - 'shop', 'categories' или 'goods'.
+    Для 'goods' значением является один товар.
+    """
+    readers = {'yaml': read_yaml, 'ndjson': read_ndjson, 'csv': read_csv}
+    return readers[get_format(name)](stream)
+
+
+@contextmanager
+def open_price_list(shop, file=None):
+    """
+    Открывает прайс-лист магазина (уже скачанный файл, загруженный файл
+    или ссылку) и возвращает пару (поток, имя) для read_price_list
+    """
+    if file:
+        file.open('rb')
+        stream, name = file.file, file.name
+    elif shop.file:
+        shop.file.open('rb')
+        stream, name = shop.file.file, shop.file.name
+    elif shop.url:
+        try:
+            result = rqs.get(shop.url, stream=True,
+                             timeout=settings.PRICE_LIST_FETCH_TIMEOUT)
+        except rqs.exceptions.RequestException as error:
+            raise get_request_error(error)
+        if not result.ok:
+            raise PriceListError('Файл не найден')
+        result.raw.decode_content = True
+        stream, name = result.raw, shop.url
+    else:
+        raise PriceListError('Нет файла для актуализации')
+
+    with stream:
+        yield stream, name
+
+
+def get_file_digest(file):
+    """
+    Хэш содержимого файла прайс-листа (sha256)
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create_session(pool_size):
+    """
+    Сессия HTTP с пулом соединений на pool_size одновременных загрузок
+    """
+    session = rqs.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def download_price_list(session, url, etag='', last_modified='',
+                        timeout=None):
+    """
+    Скачивает прайс-лист во временный файл. Если переданы заголовки
+    предыдущей загрузки и сервер ответил 304, файл не скачивается.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    try:
+        with session.get(url, headers=headers, stream=True,
+                         timeout=timeout) as response:
+            if response.status_code == 304:
+                return FetchResult(None, etag, last_modified, None)
+            if not response.ok:
+                raise PriceListError('Файл не найден')
+
+            digest = hashlib.sha256()
+            suffix = os.path.splitext(urlsplit(url).path)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix,
+                                             delete=False) as file:
+                try:
+                    for chunk in response.iter_content(
+                        chunk_size=64 * 1024
+                    ):
+                        digest.update(chunk)
+                        file.write(chunk)
+                except BaseException:
+                    # недокачанный файл не нужен
+                    file.close()
+                    os.remove(file.name)
+                    raise
+            return FetchResult(file.name,
+                               response.headers.get('ETag', ''),
+                               response.headers.get('Last-Modified', ''),
+                               digest.hexdigest())
+    except (rqs.exceptions.RequestException, OSError) as error:
+        raise get_request_error(error)
+
+
+def fetch_price_lists(sources, max_workers=None, timeout=None):
+    """
+    Параллельно скачивает прайс-листы.
+
+    sources - итератор кортежей (ключ, ссылка, etag, last_modified).
+    Возвращает словарь ключ -> FetchResult или PriceListError.
+    """
+    max_workers = max_workers or settings.PRICE_LIST_FETCH_WORKERS
+    timeout = timeout or settings.PRICE_LIST_FETCH_TIMEOUT
+    results = {}
+    with create_session(max_workers) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_price_list, session, url,
+                            etag, last_modified, timeout): key
+            for key, url, etag, last_modified in sources
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except PriceListError as error:
+                results[futures[future]] = error
+    return results
+
+
+def iter_data(data):
+    """
+    Представляет уже загруженный прайс-лист в виде итератора записей
+    """
+    yield 'shop', data['shop']
+    yield 'categories', data['categories']
+    for item in data['goods']:
+        yield 'goods', item
+
+
+def read_yaml(stream):
+    """
+    Событийный разбор YAML: товары из последовательности goods
+    собираются и возвращаются по одному, не загружая весь документ.
+    """
+    loader = yaml.SafeLoader(stream)
+    try:
+        loader.get_event()  # StreamStartEvent
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStartEvent
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise ValueError('Неверный формат прайс-листа')
+        loader.get_event()
+
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_document(loader.compose_node(None, None))
+            if key == 'goods' and loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    node = loader.compose_node(None, None)
+                    yield 'goods', loader.construct_document(node)
+                loader.get_event()
+            else:
+                node = loader.compose_node(None, None)
+                yield key, loader.construct_document(node)
+    finally:
+        loader.dispose()
+
+
+def read_ndjson(stream):
+    """
+    Разбор NDJSON: по одному JSON-объекту в строке.
+    Объекты с ключами shop и/или categories считаются заголовком,
+    остальные - товарами.
+    """
+    for line in text_stream(stream):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if 'shop' in record or 'categories' in record:
+            for key in ('shop', 'categories'):
+                if key in record:
+                    yield key, record[key]
+        else:
+            yield 'goods', record
+
+
+def read_csv(stream):
+    """
+    Разбор CSV с заголовком. Колонки id, category, model, name, price,
+    price_rrc, quantity описывают товар, category_name - название
+    категории (достаточно в первой строке категории), остальные
+    колонки - параметры.
+    """
+    categories = set()
+    for row in csv.DictReader(text_stream(stream)):
+        item = {field: int(row[field]) for field in CSV_INTEGER_FIELDS}
+        item.update(model=row.get('model', ''), name=row['name'])
+        item['parameters'] = {name: value for name, value in row.items()
+                              if name not in CSV_FIELDS and value}
+
+        if item['category'] not in categories:
+            category_name = row.get('category_name')
+            if not category_name:
+                # без названия категория не будет создана и привязана
+                # к магазину
+                raise PriceListError(
+                    f"Не указано название категории {item['category']}"
+                )
+            categories.add(item['category'])
+            yield 'categories', [{'id': item['category'],
+                                  'name': category_name}]
+        yield 'goods', item
+
+
+def text_stream(stream):
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
@@ -1,9 +1,10 @@
-from django.db.models import Sum, F
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from .delivery import NO_TIERS, delivery_index, get_delivery_cost
 from .models import User, Shop, Product, ProductParameter, \
-    ProductInfo, OrderItem, Order, Category, Address, Delivery
+    ProductInfo, OrderItem, Order, Category, Address, Delivery, ImportJob, \
+    CatalogEntry
 
 
 class AddressSerializer(serializers.ModelSerializer):
@@ -133,6 +134,34 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
+class CatalogProductSerializer(serializers.Serializer):
+    name = serializers.CharField(source='product_name')
+    category = serializers.CharField(source='category_name')
+
+
+class CatalogShopSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='shop_id')
+    name = serializers.CharField(source='shop_name')
+    state = serializers.BooleanField(source='shop_state')
+    delivery = serializers.JSONField(source='shop_delivery')
+
+
+class CatalogEntrySerializer(serializers.ModelSerializer):
+    """
+    Запись каталога в формате ProductInfoSerializer
+    """
+    id = serializers.IntegerField(source='product_info_id')
+    product = CatalogProductSerializer(source='*')
+    shop = CatalogShopSerializer(source='*')
+    product_parameters = serializers.JSONField(source='parameters')
+
+    class Meta:
+        model = CatalogEntry
+        fields = ['id', 'external_id', 'model', 'product', 'shop', 'quantity',
+                  'price', 'price_rrc', 'product_parameters', ]
+        read_only_fields = fields
+
+
 class OrderProductInfoSerializer(ProductInfoSerializer):
     class Meta:
         model = ProductInfo
@@ -151,6 +180,15 @@ class OrderItemSerializer(serializers.ModelSerializer):
         }
 
 
+class BasketItemSerializer(serializers.Serializer):
+    """
+    Позиция, добавляемая в корзину. Существование информации
+    о продукте проверяется одним запросом на все позиции
+    """
+    product_info = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
 class ShopOrderItemSerializer(OrderItemSerializer):
     product_info = OrderProductInfoSerializer(read_only=True)
 
@@ -184,51 +222,94 @@ class ShopOrderSerializer(serializers.ModelSerializer):
         return ret
 
 
+def set_shop_deliveries(shops, deliveries):
+    """
+    Проставляет стоимость доставки в данные магазинов заказа
+    (словари с id, name и shop_sum) и возвращает общую стоимость
+    доставки или список сообщений о недоступной доставке.
+    deliveries - уровни доставки магазинов из delivery_index.
+    """
+    delivery_costs = []
+    invalid_deliveries = []
+    for shop_data in shops:
+        tiers = deliveries.get(shop_data['id'], NO_TIERS)
+        if tiers[0]:
+            cost = get_delivery_cost(tiers, shop_data['shop_sum'])
+            if cost is None:
+                shop_data['delivery'] = (f"{shop_data['name']}: "
+                                         f"сумма заказа меньше минимальной.")
+                invalid_deliveries.append(shop_data['delivery'])
+            else:
+                shop_data['delivery'] = cost
+                delivery_costs.append(shop_data['delivery'])
+        else:
+            shop_data['delivery'] = (f"{shop_data['name']}: "
+                                     f"стоимость доставки недоступна.")
+            invalid_deliveries.append(shop_data['delivery'])
+
+    if invalid_deliveries:
+        return invalid_deliveries
+    return sum(delivery_costs)
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    """
+    Получает уровни доставки всех магазинов списка заказов
+    одним обращением к delivery_index
+    """
+
+    def to_representation(self, data):
+        orders = list(data.all() if hasattr(data, 'all') else data)
+        shop_ids = {item.product_info.shop_id
+                    for order in orders
+                    for item in order.ordered_items.all()}
+        self.child.deliveries = delivery_index.get_tiers(shop_ids)
+        return super().to_representation(orders)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     total_sum = serializers.IntegerField()
     address = AddressSerializer(read_only=True)
 
+    # уровни доставки магазинов, полученные OrderListSerializer
+    deliveries = None
+
     class Meta:
         model = Order
         fields = ['id', 'state', 'dt', 'total_sum', 'address']
         read_only_fields = ['id']
+        list_serializer_class = OrderListSerializer
 
     def to_representation(self, instance):
+        """
+        Позиции заказа берутся из ordered_items: при выборке заказов
+        их следует загружать через prefetch_related вместе с информацией
+        о продуктах, магазинах и параметрах.
+        """
         ret = super().to_representation(instance)
-        delivery_costs = []
-        invalid_deliveries = []
-        shops = Shop.objects.filter(
-            product_infos__ordered_items__order=instance.id
-        ).annotate(
-            shop_sum=Sum(F('product_infos__ordered_items__quantity')
-                         * F('product_infos__price'))
-        ).distinct()
-        ret['shops'] = []
-        for shop in shops:
-            shop_data = ShopOrderSerializer(shop, order_id=instance.id).data
-            shop_deliveries = Delivery.objects.filter(shop=shop)
-            if shop_deliveries:
-                shop_delivery = shop_deliveries.filter(
-                    min_sum__lte=shop_data['shop_sum']
-                ).order_by('-min_sum').first()
-                if shop_delivery is None:
-                    shop_data['delivery'] = (f"{shop_data['name']}: "
-                                             f"сумма заказа меньше минимальной.")
-                    invalid_deliveries.append(shop_data['delivery'])
-                else:
-                    shop_data['delivery'] = shop_delivery.cost
-                    delivery_costs.append(shop_data['delivery'])
-            else:
-                shop_data['delivery'] = (f"{shop_data['name']}: "
-                                         f"стоимость доставки недоступна.")
-                invalid_deliveries.append(shop_data['delivery'])
-            ret['shops'].append(shop_data)
 
-        if invalid_deliveries:
-            ret['total_delivery'] = invalid_deliveries
-        else:
-            ret['total_delivery'] = sum(delivery_costs)
+        shops = {}
+        for item in sorted(instance.ordered_items.all(),
+                           key=lambda item: item.id):
+            shop = item.product_info.shop
+            shop_data = shops.setdefault(shop.id, {
+                'id': shop.id, 'name': shop.name,
+                'shop_sum': 0, 'ordered_items': []
+            })
+            shop_data['shop_sum'] += item.quantity * item.product_info.price
+            shop_data['ordered_items'].append(
+                ShopOrderItemSerializer(item).data
+            )
+
+        deliveries = self.deliveries
+        if deliveries is None:
+            deliveries = delivery_index.get_tiers(shops)
 
+        # магазины в порядке Shop.Meta.ordering (-name)
+        ret['shops'] = sorted((shops[shop_id] for shop_id in sorted(shops)),
+                              key=lambda shop_data: shop_data['name'],
+                              reverse=True)
+        ret['total_delivery'] = set_shop_deliveries(ret['shops'], deliveries)
         return ret
 
 
@@ -253,9 +334,11 @@ class PartnerOrderSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         ret = super().to_representation(instance)
         if self.partner_id is not None:
-            ordered_items = OrderItem.objects.filter(
-                product_info__shop__user_id=self.partner_id, order=instance.id
-            ).distinct()
+            ordered_items = sorted(
+                (item for item in instance.ordered_items.all()
+                 if item.product_info.shop.user_id == self.partner_id),
+                key=lambda item: item.id
+            )
             ret['ordered_items'] = [
                 ShopOrderItemSerializer(item).data for item in ordered_items
             ]
@@ -268,3 +351,14 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', ]
         read_only_fields = ['id']
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    duration = serializers.DurationField()
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'state', 'incremental', 'rows_processed', 'stats',
+                  'errors', 'created_at', 'started_at', 'finished_at',
+                  'duration']
+        read_only_fields = fields
@@ -1,6 +1,12 @@
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django_rest_passwordreset.signals import reset_password_token_created
+from rest_framework.authtoken.models import Token
 
+from .authentication import invalidate_token, invalidate_user_tokens
+from .cache import bump_catalog_version, bump_delivery_version
+from .catalog import refresh_catalog_category, refresh_catalog_shop
+from .models import Category, Delivery, Shop, User
 from .tasks import send_email_task
 
 
@@ -25,3 +31,61 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
         # to:
         [reset_password_token.user.email]
     )
+
+
+@receiver(post_save, sender=Shop)
+def shop_saved(sender, instance, created, **kwargs):
+    """
+    Обновляем данные магазина в каталоге
+    """
+    if not created:
+        refresh_catalog_shop(instance.id)
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Delivery)
+def delivery_changed(sender, instance, **kwargs):
+    """
+    Обновляем доставку магазина в каталоге и таблицах доставки
+    """
+    refresh_catalog_shop(instance.shop_id)
+    bump_catalog_version()
+    bump_delivery_version()
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    """
+    Обновляем название категории в каталоге
+    """
+    if not created:
+        refresh_catalog_category(instance.id, instance.name)
+    bump_catalog_version()
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Shop)
+def catalog_object_deleted(sender, instance, **kwargs):
+    """
+    Удаление категории или магазина меняет ответы каталога
+    """
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    """
+    Пользователь из кэша токенов должен быть актуальным: смена пароля,
+    блокировка (is_active) и другие изменения
+    """
+    if not created:
+        invalidate_user_tokens(instance.id)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """
+    Удаленный токен (выход, удаление пользователя) больше
+    не принимается
+    """
+    invalidate_token(instance.key)
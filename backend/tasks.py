@@ -1,58 +1,308 @@
-# from celery import shared_task
+import datetime
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import shared_task
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.files import File
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .cache import bump_catalog_version
+from .importer import PriceListImporter
+from .models import ADMIN_EVENT_CHOICES, AdminNotification, ImportJob, \
+    OutboxEmail, Shop
+from .price_list import PriceListError, fetch_price_lists, \
+    get_file_digest, open_price_list, read_price_list
 
-from .models import Category, ProductInfo, Product, Parameter, \
-    ProductParameter, Shop
+logger = logging.getLogger(__name__)
 
 
-# @shared_task()
 def send_email_task(title, message, addressee_list,
                     sender=settings.EMAIL_HOST_USER):
-    # send an e-mail to the user
-    msg = EmailMultiAlternatives(title, message, sender, addressee_list)
-    msg.send()
+    """
+    Ставит письмо в очередь отправки (OutboxEmail). Письмо сохраняется
+    в текущей транзакции, отправка запускается после её фиксации.
+    """
+    OutboxEmail.objects.create(title=title, message=message, sender=sender,
+                               recipients=list(addressee_list))
+    transaction.on_commit(start_email_dispatch)
 
 
-# @shared_task()
-def do_import_task(shop_id, data):
-    # TODO select_related and prefetch_related?
-    shop = Shop.objects.get(id=shop_id)
+# поток отправки писем без брокера celery
+email_executor = ThreadPoolExecutor(max_workers=1,
+                                    thread_name_prefix='email')
+
+
+def start_email_dispatch():
+    """
+    Запускает отправку очереди писем: через celery или, если задачи
+    выполняются сразу (CELERY_TASK_ALWAYS_EAGER), в фоновом потоке,
+    чтобы отправка не задерживала ответ
+    """
+    if settings.CELERY_TASK_ALWAYS_EAGER \
+            and settings.EMAIL_DISPATCH_BACKGROUND:
+        email_executor.submit(dispatch_emails_in_background)
+    else:
+        dispatch_emails_task.delay()
+
+
+def dispatch_emails_in_background():
+    close_old_connections()
+    try:
+        # без celery beat сводки для администратора отправляются здесь
+        send_admin_digests_task()
+        dispatch_emails_task()
+    except Exception:
+        # письма останутся в очереди до следующей отправки по расписанию
+        logger.exception('Ошибка отправки очереди писем')
+    finally:
+        connection.close()
+
+
+@shared_task()
+def dispatch_emails_task(batch_size=None):
+    """
+    Отправка писем из очереди пакетами по batch_size через одно
+    соединение с почтовым сервером на пакет. Письма, которые
+    не удалось отправить, отправляются повторно с удваивающейся
+    задержкой. Возвращает количество отправленных писем.
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    sent = 0
+    while True:
+        emails = claim_outbox_emails(batch_size)
+        if emails:
+            sent += send_outbox_emails(emails)
+        if len(emails) < batch_size:
+            return sent
+
+
+def claim_outbox_emails(batch_size):
+    """
+    Закрепляет за обработчиком пакет писем, ожидающих отправки,
+    в короткой транзакции: письма получают статус 'sending' на
+    EMAIL_LEASE_SECONDS секунд, отправка идет уже без блокировок.
+    Письма, срок закрепления которых истек (обработчик завершился
+    во время отправки), закрепляются заново.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # письма, заблокированные другим обработчиком, пропускаются
+        emails = list(OutboxEmail.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            state__in=('pending', 'sending'), next_attempt_at__lte=now
+        ).order_by('id')[:batch_size])
+        OutboxEmail.objects.filter(
+            id__in=[email.id for email in emails]
+        ).update(state='sending', next_attempt_at=now + datetime.timedelta(
+            seconds=settings.EMAIL_LEASE_SECONDS
+        ))
+    return emails
+
+
+def send_outbox_emails(emails):
+    """
+    Отправляет пакет писем через одно соединение
+    и сохраняет результат отправки
+    """
+    connection = get_connection()
+    sent = 0
+    try:
+        connection.open()
+    except Exception as error:
+        for email in emails:
+            set_email_failed(email, error)
+    else:
+        try:
+            for email in emails:
+                try:
+                    EmailMultiAlternatives(email.title, email.message,
+                                           email.sender, email.recipients,
+                                           connection=connection).send()
+                except Exception as error:
+                    set_email_failed(email, error)
+                else:
+                    email.attempts += 1
+                    email.state, email.sent_at = 'sent', timezone.now()
+                    sent += 1
+        finally:
+            connection.close()
+
+    # результат сохраняется во второй короткой транзакции
+    OutboxEmail.objects.bulk_update(
+        emails, fields=['state', 'attempts', 'next_attempt_at', 'errors',
+                        'sent_at']
+    )
+    return sent
 
-    # TODO clear shop categories?
-    for category in data['categories']:
-        category_object, _ = Category.objects.get_or_create(
-            id=category['id'], name=category['name']
-        )
-        category_object.shops.add(shop.id)
-        category_object.save()
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-    for item in data['goods']:
-        product, _ = Product.objects.get_or_create(
-            name=item['name'], category_id=item['category']
-        )
 
-        product_info = ProductInfo.objects.create(
-            product_id=product.id,
-            external_id=item['id'],
-            model=item['model'],
-            price=item['price'],
-            price_rrc=item['price_rrc'],
-            quantity=item['quantity'],
-            shop_id=shop.id
+def set_email_failed(email, error):
+    """
+    Откладывает повторную отправку письма: задержка удваивается
+    с каждой попыткой, после EMAIL_MAX_ATTEMPTS попыток письмо
+    получает статус 'failed'
+    """
+    email.attempts += 1
+    email.errors += f"{timezone.now():%Y-%m-%d %H:%M:%S} {error}\n"
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.state = 'failed'
+    else:
+        email.state = 'pending'
+        email.next_attempt_at = timezone.now() + datetime.timedelta(
+            seconds=settings.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1)
         )
-        for name, value in item['parameters'].items():
-            parameter_object, _ = Parameter.objects.get_or_create(
-                name=name
-            )
-            ProductParameter.objects.create(
-                product_info_id=product_info.id,
-                parameter_id=parameter_object.id,
-                value=value
+
+
+def notify_admin(event, title, message):
+    """
+    Уведомление администратора о событии event (new_order, price_list).
+    Если для события задано окно ADMIN_DIGEST_WINDOWS, уведомление
+    откладывается до отправки сводки, иначе письмо отправляется сразу.
+    """
+    if settings.ADMIN_DIGEST_WINDOWS.get(event):
+        AdminNotification.objects.create(event=event, message=message)
+    else:
+        send_email_task(title, message, [settings.ADMIN_EMAIL])
+
+
+@shared_task()
+def send_admin_digests_task():
+    """
+    Отправляет администратору сводки по событиям, у которых самое старое
+    неотправленное уведомление ждет дольше окна сводки.
+    Возвращает количество отправленных сводок.
+    """
+    now = timezone.now()
+    digests = 0
+    for event, event_name in ADMIN_EVENT_CHOICES:
+        window = settings.ADMIN_DIGEST_WINDOWS.get(event)
+        with transaction.atomic():
+            # уведомления, которые уже собирает другой обработчик,
+            # пропускаются
+            notifications = list(AdminNotification.objects.select_for_update(
+                skip_locked=True
+            ).filter(
+                event=event, sent_at__isnull=True
+            ).order_by('created_at'))
+            if not notifications or (
+                window and
+                notifications[0].created_at
+                > now - datetime.timedelta(seconds=window)
+            ):
+                continue
+
+            title = f"{event_name}: {len(notifications)}"
+            message = '\n'.join(
+                f"{timezone.localtime(notification.created_at):%d.%m.%Y %H:%M}"
+                f" {notification.message}"
+                for notification in notifications
             )
+            send_email_task(title, message, [settings.ADMIN_EMAIL])
+            AdminNotification.objects.filter(
+                id__in=[notification.id for notification in notifications]
+            ).update(sent_at=now)
+            digests += 1
+    return digests
+
 
-    shop.name = data['shop']
-    shop.is_uptodate = True
-    shop.save()
+def skip_import_job(job, **shop_fields):
+    """
+    Завершает задание без загрузки: прайс-лист не изменился
+    """
+    job.state, job.finished_at = 'skipped', timezone.now()
+    job.save()
+    Shop.objects.filter(id=job.shop_id).update(is_uptodate=True,
+                                               **shop_fields)
 
 
+@shared_task()
+def fetch_price_lists_task(job_ids):
+    """
+    Параллельная загрузка прайс-листов по ссылкам для заданий job_ids
+    с последующей постановкой заданий на импорт в очередь.
+    Неизмененные с прошлой загрузки прайс-листы пропускаются.
+    """
+    jobs = ImportJob.objects.select_related('shop').filter(
+        id__in=job_ids, state='pending'
+    )
+    results = fetch_price_lists(
+        (job.id, job.shop.url, job.shop.url_etag, job.shop.url_last_modified)
+        for job in jobs if not job.shop.file and job.shop.url
+    )
+
+    for job in jobs:
+        result = results.get(job.id)
+        if isinstance(result, PriceListError):
+            job.state, job.errors = 'failed', str(result)
+            job.finished_at = timezone.now()
+            job.save()
+        elif result is not None and result.path is None:
+            skip_import_job(job)
+        elif (result is not None and job.incremental
+              and result.digest == job.shop.price_list_digest):
+            os.remove(result.path)
+            skip_import_job(job, url_etag=result.etag,
+                            url_last_modified=result.last_modified)
+        else:
+            if result is not None:
+                with open(result.path, 'rb') as file:
+                    job.file.save(os.path.basename(result.path), File(file),
+                                  save=False)
+                os.remove(result.path)
+                job.url_etag = result.etag
+                job.url_last_modified = result.last_modified
+                job.digest = result.digest
+                job.save()
+            do_import_task.delay(job.id)
+
+
+@shared_task()
+def do_import_task(job_id, batch_size=None):
+    """
+    Выполнение задания на загрузку прайс-листа магазина.
+    Если хэш файла совпадает с хэшем последней загрузки,
+    инкрементальное задание завершается без изменений.
+    """
+    job = ImportJob.objects.select_related('shop').get(id=job_id)
+    source = job.file or job.shop.file
+    if source and not job.digest:
+        job.digest = get_file_digest(source)
+    if job.incremental and job.digest \
+            and job.digest == job.shop.price_list_digest:
+        if job.file:
+            job.file.delete(save=False)
+        skip_import_job(job, url_etag=job.url_etag,
+                        url_last_modified=job.url_last_modified)
+        return job.state
+
+    job.state, job.started_at = 'running', timezone.now()
+    job.save(update_fields=['state', 'started_at', 'digest'])
+
+    importer = PriceListImporter(job.shop, batch_size=batch_size,
+                                 incremental=job.incremental,
+                                 progress=job.set_progress)
+    try:
+        with open_price_list(job.shop, job.file) as (stream, name):
+            job.stats = importer.import_records(
+                read_price_list(stream, name)
+            )
+    except Exception as error:
+        job.state, job.errors = 'failed', str(error)
+    else:
+        job.state = 'done'
+        Shop.objects.filter(id=job.shop_id).update(
+            url_etag=job.url_etag,
+            url_last_modified=job.url_last_modified,
+            price_list_digest=job.digest
+        )
+        bump_catalog_version()
+    if job.file:
+        job.file.delete(save=False)
+    job.rows_processed = importer.rows_processed
+    job.finished_at = timezone.now()
+    job.save()
+    return job.state
@@ -1,3 +1,942 @@
-from django.test import TestCase
+import datetime
+import gc
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import yaml
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, \
+    TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from psycopg2 import extensions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from orders.postgresql.base import ConnectionPool, Database, \
+    DatabaseWrapper, PostgresDatabaseWrapper, pools
+from orders.profiling import QueryProfilingMiddleware
+from orders.routers import ReplicaMiddleware, use_replicas
+
+from .async_views import database_sync_to_async
+from .authentication import CachedTokenAuthentication, \
+    get_token_cache, get_token_cache_key, invalidate_user_tokens
+from .basket import place_order
+from .cache import get_catalog_version
+from .delivery import DeliveryIndex
+from .importer import PriceListImporter
+from .management.commands.benchmark_api import Command as BenchmarkApi, \
+    get_cases, get_fixtures
+from .management.commands.explain_queries import explain, \
+    get_hot_queries
+from .management.commands.loadtest_checkout import \
+    Command as LoadtestCheckout
+from .models import AdminNotification, CatalogEntry, Category, Delivery, \
+    Order, OrderItem, OutboxEmail, Product, ProductInfo, ProductParameter, \
+    Shop, User
+from .price_list import PriceListError, read_price_list
+from .tasks import dispatch_emails_task, notify_admin
+from .throttling import RateThrottle, get_throttle_cache, get_throttle_key
+
+
+class PlaceOrderTest(TestCase):
+    def test_catalog_version_bumped(self):
+        """
+        Остатки входят в кэшированные ответы каталога, поэтому версия
+        каталога меняется при каждом заказе, а не только когда товар
+        закончился
+        """
+        product_info, users = LoadtestCheckout().create_data('test', 1, 5, 1)
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(*users[0])
+
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(CatalogEntry.objects.get(
+            product_info_id=product_info.id
+        ).quantity, 4)
+
+
+def get_price_list(changes=None):
+    """
+    Небольшой прайс-лист, changes - изменения товаров по их id
+    """
+    goods = [
+        {'id': 1, 'category': 1, 'model': 'a', 'name': 'Телефон A',
+         'price': 100, 'price_rrc': 120, 'quantity': 5,
+         'parameters': {'Цвет': 'черный', 'Память (Гб)': 64}},
+        {'id': 2, 'category': 1, 'model': 'b', 'name': 'Телефон B',
+         'price': 200, 'price_rrc': 220, 'quantity': 3,
+         'parameters': {'Цвет': 'белый'}},
+    ]
+    for item in goods:
+        item.update((changes or {}).get(item['id'], {}))
+    return {'shop': 'test', 'categories': [{'id': 1, 'name': 'Телефоны'}],
+            'goods': goods}
+
+
+class IncrementalImportTest(TestCase):
+    def setUp(self):
+        self.shop = Shop.objects.create(name='test')
+        PriceListImporter(self.shop).import_data(get_price_list())
+        self.ids = dict(ProductInfo.objects.filter(
+            shop=self.shop
+        ).values_list('external_id', 'id'))
+
+    def import_data(self, data):
+        return PriceListImporter(self.shop, incremental=True) \
+            .import_data(data)
+
+    def test_unchanged(self):
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.import_data(get_price_list())
+
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'deleted': 0,
+                                 'unchanged': 2})
+        # сохраняются только магазин, его категории и данные магазина
+        # в каталоге, товары не записываются
+        shop_writes = ('UPDATE "backend_shop" ',
+                       'INSERT OR IGNORE INTO "backend_category_shops" ',
+                       'INSERT INTO "backend_category_shops" ',
+                       'UPDATE "backend_catalogentry" SET "shop_name" ')
+        self.assertEqual([query['sql'] for query in queries
+                          if query['sql'].startswith(('INSERT', 'UPDATE',
+                                                      'DELETE'))
+                          and not query['sql'].startswith(shop_writes)], [])
+
+    def test_price_changed(self):
+        order = Order.objects.create(
+            user=User.objects.create_user('buyer@example.com'),
+            state='basket'
+        )
+        OrderItem.objects.create(order=order, product_info_id=self.ids[1],
+                                 quantity=1)
+
+        stats = self.import_data(get_price_list({1: {'price': 150}}))
+
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'deleted': 0,
+                                 'unchanged': 1})
+        product_info = ProductInfo.objects.get(shop=self.shop, external_id=1)
+        self.assertEqual((product_info.id, product_info.price),
+                         (self.ids[1], 150))
+        self.assertEqual(CatalogEntry.objects.get(
+            product_info_id=self.ids[1]
+        ).price, 150)
+        self.assertTrue(OrderItem.objects.filter(
+            order=order, product_info_id=self.ids[1]
+        ).exists())
+
+    def test_deleted(self):
+        data = get_price_list()
+        del data['goods'][1]
+        stats = self.import_data(data)
+
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'deleted': 1,
+                                 'unchanged': 1})
+        self.assertEqual(list(ProductInfo.objects.filter(
+            shop=self.shop
+        ).values_list('id', flat=True)), [self.ids[1]])
+
+    def test_parameter_changed(self):
+        stats = self.import_data(get_price_list(
+            {2: {'parameters': {'Цвет': 'красный', 'Память (Гб)': 128}}}
+        ))
+
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'deleted': 0,
+                                 'unchanged': 1})
+        self.assertEqual(dict(ProductParameter.objects.filter(
+            product_info_id=self.ids[2]
+        ).values_list('parameter__name', 'value')),
+            {'Цвет': 'красный', 'Память (Гб)': '128'})
+        self.assertCountEqual(CatalogEntry.objects.get(
+            product_info_id=self.ids[2]
+        ).parameters, [{'parameter': 'Цвет', 'value': 'красный'},
+                       {'parameter': 'Память (Гб)', 'value': '128'}])
+
+
+class PriceListReaderTest(TestCase):
+    @staticmethod
+    def get_goods(shop):
+        return sorted(
+            (product_info.external_id, product_info.product.name,
+             product_info.model, product_info.price, product_info.quantity,
+             sorted((parameter.parameter.name, parameter.value) for parameter
+                    in product_info.product_parameters.all()))
+            for product_info in ProductInfo.objects.filter(
+                shop=shop
+            ).select_related('product').prefetch_related(
+                'product_parameters__parameter'
+            )
+        )
+
+    def test_yaml_by_batches(self):
+        """
+        Потоковый разбор YAML дает то же, что загрузка всего документа
+        """
+        path = os.path.join(settings.BASE_DIR, 'data', 'shop1.yaml')
+        streamed, loaded = Shop.objects.create(name='streamed'), \
+            Shop.objects.create(name='loaded')
+        with open(path, 'rb') as stream:
+            stats = PriceListImporter(streamed, batch_size=2).import_records(
+                read_price_list(stream, 'shop1.yaml')
+            )
+        with open(path, encoding='utf-8') as stream:
+            expected = PriceListImporter(loaded).import_data(
+                yaml.safe_load(stream)
+            )
+
+        self.assertEqual(stats, expected)
+        self.assertEqual(self.get_goods(streamed), self.get_goods(loaded))
+        self.assertEqual(set(streamed.categories.all()),
+                         set(loaded.categories.all()))
+
+    def test_ndjson(self):
+        stream = io.BytesIO(
+            '{"shop": "test", "categories": [{"id": 1, "name": "Телефоны"}]}\n'
+            '\n'
+            '{"id": 1, "category": 1, "name": "A", "parameters": {}}\n'
+            .encode()
+        )
+        self.assertEqual(list(read_price_list(stream, 'shop.ndjson')), [
+            ('shop', 'test'),
+            ('categories', [{'id': 1, 'name': 'Телефоны'}]),
+            ('goods', {'id': 1, 'category': 1, 'name': 'A',
+                       'parameters': {}}),
+        ])
+
+    def test_csv(self):
+        stream = io.BytesIO(
+            'id,category,category_name,model,name,price,price_rrc,'
+            'quantity,Цвет\n'
+            '1,1,Телефоны,a,A,100,120,5,черный\n'
+            '2,1,,b,B,200,220,3,\n'.encode()
+        )
+        self.assertEqual(list(read_price_list(stream, 'shop.csv')), [
+            ('categories', [{'id': 1, 'name': 'Телефоны'}]),
+            ('goods', {'id': 1, 'category': 1, 'price': 100,
+                       'price_rrc': 120, 'quantity': 5, 'model': 'a',
+                       'name': 'A', 'parameters': {'Цвет': 'черный'}}),
+            ('goods', {'id': 2, 'category': 1, 'price': 200,
+                       'price_rrc': 220, 'quantity': 3, 'model': 'b',
+                       'name': 'B', 'parameters': {}}),
+        ])
+
+    def test_csv_without_category_name(self):
+        stream = io.BytesIO(
+            'id,category,model,name,price,price_rrc,quantity\n'
+            '1,1,a,A,100,120,5\n'.encode()
+        )
+        with self.assertRaises(PriceListError):
+            list(read_price_list(stream, 'shop.csv'))
+
+
+class CacheResponseTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='test')
+
+    def get_names(self):
+        response = self.client.get(reverse('categories'))
+        return [category['name'] for category in response.json()]
+
+    def test_local_cache_not_used(self):
+        """
+        Версия каталога в кэше в памяти не видна другим процессам,
+        поэтому ответы не кэшируются
+        """
+        self.assertEqual(self.get_names(), ['test'])
+        # изменение без сигналов, как в другом процессе
+        Category.objects.filter(id=self.category.id).update(name='changed')
+        self.assertEqual(self.get_names(), ['changed'])
+
+    def test_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }, 'throttle': {
+                'BACKEND':
+                    'django.core.cache.backends.locmem.LocMemCache',
+            }}
+        ):
+            self.get_names()
+            with self.assertNumQueries(0):
+                self.assertEqual(self.get_names(), ['test'])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.category.name = 'changed'
+                self.category.save()
+            self.assertEqual(self.get_names(), ['changed'])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTest(TransactionTestCase):
+    def test_no_oversell(self):
+        """
+        Одновременные заказы товара с ограниченным остатком:
+        оформляется не больше заказов, чем есть товара
+        """
+        command = LoadtestCheckout()
+        product_info, users = command.create_data('test', 10, 4, 1)
+        results, _ = command.run_checkouts(users)
+
+        outcomes = [result for result, _ in results]
+        self.assertEqual(outcomes.count('ok'), 4)
+        self.assertEqual(outcomes.count('rejected'), 6)
+        product_info.refresh_from_db()
+        self.assertEqual(product_info.quantity, 0)
+        self.assertEqual(Order.objects.filter(state='new').count(), 4)
+        self.assertEqual(CatalogEntry.objects.get(
+            product_info_id=product_info.id
+        ).quantity, 0)
+
+    @staticmethod
+    def create_product_info(shop, product):
+        return ProductInfo.objects.create(
+            product=product, shop=shop, external_id=product.id,
+            model='test', quantity=100, price=100, price_rrc=100
+        )
+
+    def test_shared_products_no_deadlock(self):
+        """
+        Два магазина продают одни и те же продукты, но id их товаров
+        идут в противоположном порядке продуктов: заказы не блокируют
+        общие строки Product взаимно
+        """
+        command = LoadtestCheckout()
+        first, users = command.create_data('test', 10, 100, 1)
+        second_product = Product.objects.create(
+            name='test-2', category=first.product.category
+        )
+        second_shop = Shop.objects.create(
+            name='test-2', user=User.objects.create_user(
+                'test-2-shop@example.com', type='shop', is_active=True
+            )
+        )
+        Delivery.objects.create(shop=second_shop, min_sum=0, cost=0)
+        baskets = [
+            # продукты 1, 2 в порядке id товаров
+            [first, self.create_product_info(first.shop, second_product)],
+            # продукты 2, 1
+            [self.create_product_info(second_shop, second_product),
+             self.create_product_info(second_shop, first.product)],
+        ]
+        for index, (user_id, _) in enumerate(users):
+            order = Order.objects.get(user_id=user_id, state='basket')
+            order.ordered_items.all().delete()
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product_info=product_info, quantity=1)
+                for product_info in baskets[index % 2]
+            )
+
+        results, _ = command.run_checkouts(users)
+
+        self.assertEqual([result for result, _ in results], ['ok'] * 10)
+
+
+class DeliveryIndexTest(TestCase):
+    def setUp(self):
+        product_info, _ = LoadtestCheckout().create_data('test', 0, 1, 1)
+        self.shop_id = product_info.shop_id
+        self.index = DeliveryIndex()
+
+    def test_local_cache_reads_database(self):
+        """
+        С кэшем в памяти процесса изменения доставки из других процессов
+        не видны, поэтому уровни читаются из базы при каждом вызове
+        """
+        self.assertEqual(self.index.get_tiers([self.shop_id]),
+                         {self.shop_id: ((0,), (0,))})
+        # изменение без сигналов, как в другом процессе
+        Delivery.objects.filter(shop_id=self.shop_id).update(cost=100)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.get_tiers([self.shop_id]),
+                             {self.shop_id: ((0,), (100,))})
+
+    def test_shared_cache(self):
+        """
+        С общим кэшем уровни хранятся в памяти до изменения доставки
+        """
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+        ):
+            self.index.get_tiers([self.shop_id])
+            with self.assertNumQueries(0):
+                self.index.get_tiers([self.shop_id])
+
+            delivery = Delivery.objects.get(shop_id=self.shop_id)
+            delivery.cost = 100
+            with self.captureOnCommitCallbacks(execute=True):
+                delivery.save()
+            self.assertEqual(self.index.get_tiers([self.shop_id]),
+                             {self.shop_id: ((0,), (100,))})
+
+
+class OutboxEmailTest(TestCase):
+    def create_email(self, **fields):
+        return OutboxEmail.objects.create(title='Тема', message='Текст',
+                                          sender='shop@example.com',
+                                          recipients=['buyer@example.com'],
+                                          **fields)
+
+    def test_sent_after_claim(self):
+        """
+        Письмо закрепляется за обработчиком (статус 'sending') до
+        отправки, результат сохраняется после нее
+        """
+        email = self.create_email()
+        states = []
+
+        def send(message):
+            states.append(OutboxEmail.objects.get(id=email.id).state)
+            return 1
+
+        with mock.patch('backend.tasks.EmailMultiAlternatives.send',
+                        autospec=True, side_effect=send):
+            self.assertEqual(dispatch_emails_task(), 1)
+
+        self.assertEqual(states, ['sending'])
+        email.refresh_from_db()
+        self.assertEqual((email.state, email.attempts), ('sent', 1))
+
+    def test_failed_email_retried(self):
+        email = self.create_email()
+        with mock.patch('backend.tasks.EmailMultiAlternatives.send',
+                        side_effect=OSError('нет соединения')):
+            self.assertEqual(dispatch_emails_task(), 0)
+
+        email.refresh_from_db()
+        self.assertEqual((email.state, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('нет соединения', email.errors)
+
+    def test_expired_lease_reclaimed(self):
+        """
+        Письмо, обработчик которого завершился во время отправки,
+        отправляется после окончания срока закрепления
+        """
+        now = timezone.now()
+        expired = self.create_email(
+            state='sending', next_attempt_at=now - datetime.timedelta(
+                seconds=1
+            )
+        )
+        leased = self.create_email(
+            state='sending', next_attempt_at=now + datetime.timedelta(
+                minutes=5
+            )
+        )
+
+        self.assertEqual(dispatch_emails_task(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        expired.refresh_from_db()
+        leased.refresh_from_db()
+        self.assertEqual(expired.state, 'sent')
+        self.assertEqual(leased.state, 'sending')
+
+
+class AdminDigestTest(TestCase):
+    @override_settings(ADMIN_DIGEST_WINDOWS={'new_order': 60,
+                                             'price_list': 0})
+    def test_send_emails_sends_digests(self):
+        """
+        Без celery beat сводку отправляет команда send_emails
+        """
+        notify_admin('new_order', 'Новый заказ', 'Заказ 1')
+        notify_admin('new_order', 'Новый заказ', 'Заказ 2')
+        call_command('send_emails', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        AdminNotification.objects.update(
+            created_at=timezone.now() - datetime.timedelta(minutes=2)
+        )
+        call_command('send_emails', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Заказ 2', mail.outbox[0].body)
+        self.assertFalse(AdminNotification.objects.filter(
+            sent_at__isnull=True
+        ).exists())
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'планы запросов проверяются на PostgreSQL')
+class HotQueryPlanTest(TestCase):
+    def test_indexes_used(self):
+        """
+        Основные запросы используют свои индексы (см. explain_queries)
+        """
+        for name, table, indexes, queryset in get_hot_queries():
+            with self.subTest(name):
+                plan = explain(queryset)
+                self.assertTrue(any(index in plan for index in indexes),
+                                f"нет индекса {', '.join(indexes)}:\n{plan}")
+
+
+class ApiQueryCountTest(TestCase):
+    """
+    Количество запросов к базе по всем адресам API (см. benchmark_api)
+    на небольшой заполненной базе
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_data', shops=5, goods=20, products=50,
+                     categories=5, parameters=5, buyers=5, orders=60,
+                     items=2, stdout=io.StringIO())
+
+    def test_query_counts(self):
+        """
+        Допустимое количество запросов с пустым и с заполненным общим
+        кэшем, без N+1 (количество запросов не растет с размером
+        страницы)
+        """
+        command = BenchmarkApi()
+        fixtures = get_fixtures()
+        clients = command.get_clients(fixtures)
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={alias: {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': f'{location}/{alias}',
+            } for alias in ('default', 'throttle')}
+        ):
+            for case in get_cases(fixtures):
+                with self.subTest(case.name):
+                    result = command.run_case(case, clients[case.user], 1)
+                    self.assertEqual(
+                        command.check_result(case, result, None, {}), []
+                    )
+
+
+class FakeConnection:
+    """
+    Соединение psycopg2 для проверки пула без PostgreSQL
+    """
+
+    def __init__(self, status=extensions.TRANSACTION_STATUS_IDLE,
+                 usable=True):
+        self.closed = 0
+        self.isolation_level = extensions.ISOLATION_LEVEL_READ_COMMITTED
+        self.info = SimpleNamespace(transaction_status=status)
+        self.usable = usable
+        self.rolled_back = False
+
+    def cursor(self):
+        if not self.usable:
+            raise Database.OperationalError('соединение разорвано')
+        return mock.MagicMock()
+
+    def rollback(self):
+        self.rolled_back = True
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def test_acquire_timeout(self):
+        """
+        Пока есть место, acquire резервирует его для нового соединения,
+        затем ждет свободное не дольше timeout
+        """
+        pool = ConnectionPool(max_size=2, timeout=0.05)
+        self.assertIsNone(pool.acquire(health_check=False))
+        self.assertIsNone(pool.acquire(health_check=False))
+        self.assertEqual(pool.size, 2)
+        with self.assertRaises(Database.OperationalError):
+            pool.acquire(health_check=False)
+
+    def test_release_and_reuse(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(health_check=False)
+        connection = FakeConnection()
+        pool.release(connection)
+
+        self.assertIs(pool.acquire(health_check=True), connection)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(pool.idle, [])
+
+    def test_release_rolls_back_transaction(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(health_check=False)
+        connection = FakeConnection(extensions.TRANSACTION_STATUS_INERROR)
+        pool.release(connection)
+
+        self.assertTrue(connection.rolled_back)
+        self.assertEqual(pool.idle, [connection])
+
+    def test_release_discards_unknown_state(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(health_check=False)
+        connection = FakeConnection(extensions.TRANSACTION_STATUS_UNKNOWN)
+        pool.release(connection)
+
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.size, pool.idle), (0, []))
+
+    def test_health_check_discards_broken_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.acquire(health_check=False)
+        connection = FakeConnection(usable=False)
+        pool.release(connection)
+
+        self.assertIsNone(pool.acquire(health_check=True))
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_discard_wakes_waiting_thread(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        pool.acquire(health_check=False)
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(pool.acquire(health_check=False))
+        )
+        thread.start()
+        pool.discard(FakeConnection())
+        thread.join()
+
+        self.assertEqual(results, [None])
+        self.assertEqual(pool.size, 1)
+
+    def test_lost_wrapper_returns_connection(self):
+        """
+        Соединение обертки, удаленной без закрытия (поток завершился),
+        возвращается в пул; закрытое обертка возвращает сама и только
+        один раз
+        """
+        alias = 'pool_test'
+        self.addCleanup(pools.pop, (alias, os.getpid()), None)
+        settings_dict = dict(connections['default'].settings_dict,
+                             OPTIONS={}, POOL={'MAX_SIZE': 2,
+                                               'TIMEOUT': 0.05})
+
+        with mock.patch.object(PostgresDatabaseWrapper, 'get_new_connection',
+                               side_effect=lambda params: FakeConnection()):
+            wrapper = DatabaseWrapper(settings_dict, alias)
+            lost = wrapper.get_new_connection({})
+            pool = wrapper.pool
+            del wrapper
+            gc.collect()
+            self.assertEqual((pool.size, pool.idle), (1, [lost]))
+
+            wrapper = DatabaseWrapper(settings_dict, alias)
+            wrapper.connection = wrapper.get_new_connection({})
+            self.assertIs(wrapper.connection, lost)
+            wrapper._close()
+            del wrapper
+            gc.collect()
+            self.assertEqual((pool.size, pool.idle), (1, [lost]))
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'соединения проверяются на PostgreSQL')
+class PooledDatabaseWrapperTest(TestCase):
+    """
+    Обертка orders.postgresql с настоящими соединениями: запрос,
+    возврат соединения в пул и его повторное использование
+    """
+    alias = 'pool_test'
+
+    def setUp(self):
+        # после закрытия оберток, которые возвращают соединения в пул
+        self.addCleanup(self.close_pool)
+
+    def close_pool(self):
+        pool = pools.pop((self.alias, os.getpid()), None)
+        if pool is not None:
+            pool.close()
+
+    def get_wrapper(self, **overrides):
+        settings_dict = dict(connection.settings_dict, CONN_MAX_AGE=0,
+                             CONN_HEALTH_CHECKS=True)
+        settings_dict.update(overrides)
+        wrapper = DatabaseWrapper(settings_dict, self.alias)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    @staticmethod
+    def get_backend_pid(wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def terminate(pid):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s, 5000)', [pid])
+
+    def test_reuse(self):
+        wrapper = self.get_wrapper(POOL={'MAX_SIZE': 2, 'TIMEOUT': 1},
+                                   OPTIONS={'isolation_level': extensions
+                                            .ISOLATION_LEVEL_SERIALIZABLE})
+        pid = self.get_backend_pid(wrapper)
+        raw = wrapper.connection
+        # конец HTTP-запроса
+        wrapper.close_if_unusable_or_obsolete()
+        pool = wrapper.pool
+        self.assertIsNone(wrapper.connection)
+        self.assertEqual((pool.size, pool.idle), (1, [raw]))
+
+        self.assertEqual(self.get_backend_pid(wrapper), pid)
+        self.assertIs(wrapper.connection, raw)
+        self.assertEqual(wrapper.isolation_level,
+                         extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        # уровень изоляции psycopg2 задает в начале каждой транзакции
+        wrapper.set_autocommit(False)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SHOW transaction_isolation')
+            self.assertEqual(cursor.fetchone()[0], 'serializable')
+        wrapper.rollback()
+        wrapper.set_autocommit(True)
+        self.assertEqual((pool.size, pool.idle), (1, []))
+
+    def test_broken_idle_connection_replaced(self):
+        wrapper = self.get_wrapper(POOL={'MAX_SIZE': 1, 'TIMEOUT': 1})
+        pid = self.get_backend_pid(wrapper)
+        wrapper.close_if_unusable_or_obsolete()
+        self.terminate(pid)
+
+        self.assertNotEqual(self.get_backend_pid(wrapper), pid)
+        self.assertEqual(wrapper.pool.size, 1)
+
+    def test_health_check_before_first_cursor(self):
+        """
+        Сохраненное соединение, разорванное между HTTP-запросами,
+        заменяется перед первым запросом к базе
+        """
+        wrapper = self.get_wrapper(CONN_MAX_AGE=None)
+        pid = self.get_backend_pid(wrapper)
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertIsNotNone(wrapper.connection)
+        self.terminate(pid)
+
+        self.assertNotEqual(self.get_backend_pid(wrapper), pid)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaMiddlewareTest(SimpleTestCase):
+    def test_local_cache_refused(self):
+        """
+        Закрепление в кэше одного процесса не видно другим процессам
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaMiddleware(lambda request: HttpResponse())
+
+    def test_pinned_after_write(self):
+        reads = []
+
+        def get_response(request):
+            reads.append(use_replicas.get())
+            return HttpResponse()
+
+        factory = RequestFactory()
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.locmem.LocMemCache',
+            }, 'replica': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+        ):
+            middleware = ReplicaMiddleware(get_response)
+            for request in (
+                factory.get('/', HTTP_AUTHORIZATION='Token first'),
+                factory.post('/', HTTP_AUTHORIZATION='Token first'),
+                factory.get('/', HTTP_AUTHORIZATION='Token first'),
+                factory.get('/', HTTP_AUTHORIZATION='Token second'),
+            ):
+                middleware(request)
+
+        self.assertEqual(reads, [True, False, False, True])
+
+
+class RateThrottleTest(SimpleTestCase):
+    """
+    Ограничение входа 10/min скользящим окном
+    """
+
+    def setUp(self):
+        get_throttle_cache().clear()
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+        self.view = SimpleNamespace(throttle_scope='login')
+
+    def allow(self, now, count=1):
+        """
+        count запросов в момент now, возвращает последний ограничитель
+        и разрешенные запросы
+        """
+        allowed = []
+        for _ in range(count):
+            throttle = RateThrottle()
+            throttle.timer = lambda: now
+            allowed.append(throttle.allow_request(self.request, self.view))
+        return throttle, allowed
+
+    def test_limit(self):
+        _, allowed = self.allow(120, 10)
+        self.assertEqual(allowed, [True] * 10)
+        throttle, allowed = self.allow(124)
+        self.assertEqual(allowed, [False])
+        # в следующем окне запрос разрешен, когда доля 10 запросов
+        # предыдущего окна станет не больше 9: через 56 + 6 секунд
+        self.assertEqual(throttle.wait(), 62)
+        self.assertEqual(self.allow(185.9)[1], [False])
+        self.assertEqual(self.allow(186)[1], [True])
+
+    def test_previous_window_share(self):
+        self.allow(120, 10)
+        # половина окна: учитывается 5 запросов предыдущего окна
+        self.assertEqual(self.allow(210, 6)[1], [True] * 5 + [False])
+
+    def test_rejected_not_counted(self):
+        self.allow(120, 10)
+        self.allow(124, 5)
+        key = get_throttle_key('login', 'ip:127.0.0.1')
+        self.assertEqual(get_throttle_cache().get(f"{key}:2"), 10)
+        self.assertEqual(self.allow(186)[1], [True])
+
+
+@override_settings(QUERY_PROFILING=True, QUERY_PROFILING_SAMPLE_RATE=1,
+                   DEBUG=True)
+class QueryProfilingTest(TransactionTestCase):
+    def test_sync_view(self):
+        def get_response(request):
+            User.objects.count()
+            return HttpResponse()
+
+        response = QueryProfilingMiddleware(get_response)(
+            RequestFactory().get('/')
+        )
+        self.assertEqual(response['X-DB-Queries'], '1')
+
+    def test_async_view(self):
+        """
+        Учитываются запросы, выполненные в потоках database_sync_to_async
+        """
+        # свой поток, чтобы закрыть его соединение после теста
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        self.addCleanup(lambda: executor.submit(connections.close_all)
+                        .result())
+        with mock.patch('backend.async_views.executor', executor):
+            count_users = database_sync_to_async(User.objects.count)
+
+        async def get_response(request):
+            await count_users()
+            await count_users()
+            return HttpResponse()
+
+        middleware = QueryProfilingMiddleware(get_response)
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response['X-DB-Queries'], '2')
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@example.com', 'secret',
+                                             is_active=True)
+        self.key = Token.objects.create(user=self.user).key
+        self.authentication = CachedTokenAuthentication()
+
+    def test_local_cache_not_used(self):
+        """
+        Удаление из кэша в памяти не видно другим процессам, поэтому
+        токен проверяется по базе
+        """
+        self.authentication.authenticate_credentials(self.key)
+        with self.assertNumQueries(1):
+            self.authentication.authenticate_credentials(self.key)
+
+        # без сигналов, как в другом процессе
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.key)
+
+    def test_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+        ):
+            self.authentication.authenticate_credentials(self.key)
+            with self.assertNumQueries(0):
+                self.authentication.authenticate_credentials(self.key)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                User.objects.filter(id=self.user.id).update(is_active=False)
+                invalidate_user_tokens(self.user.id)
+            with self.assertRaises(AuthenticationFailed):
+                self.authentication.authenticate_credentials(self.key)
+
+    def test_cached_user(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+        ):
+            self.authentication.authenticate_credentials(self.key)
+            entry = get_token_cache().get(get_token_cache_key(self.key))
+            self.assertNotIn(self.user.password, entry['user'])
+
+            user, token = self.authentication.authenticate_credentials(
+                self.key
+            )
+            self.assertEqual((user.id, user.email, token.key),
+                             (self.user.id, self.user.email, self.key))
+            # хэш пароля читается из базы
+            with self.assertNumQueries(1):
+                self.assertTrue(user.check_password('secret'))
+
+    def test_change_during_database_read(self):
+        """
+        Пользователь, прочитанный из базы до изменения, зафиксированного
+        до записи в кэш, не принимается из кэша
+        """
+        authenticate = TokenAuthentication.authenticate_credentials
+
+        def deactivate_after_read(authentication, key):
+            result = authenticate(authentication, key)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.is_active = False
+                self.user.save()
+            return result
+
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+        ):
+            with mock.patch.object(TokenAuthentication,
+                                   'authenticate_credentials',
+                                   deactivate_after_read):
+                self.authentication.authenticate_credentials(self.key)
+            with self.assertRaises(AuthenticationFailed):
+                self.authentication.authenticate_credentials(self.key)
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+def get_throttle_cache():
+    return caches[settings.THROTTLE_CACHE_ALIAS]
+
+
+def get_throttle_key(scope, ident):
+    return f"throttle:{scope}:{ident}"
+
+
+def get_user_ident(user_id):
+    return f"user:{user_id}"
+
+
+def reset_throttles(ident):
+    """
+    Сбрасывает счетчики клиента во всех областях, например перед
+    нагрузочной проверкой
+    """
+    throttle = RateThrottle()
+    now = throttle.timer()
+    keys = []
+    for scope, rate in api_settings.DEFAULT_THROTTLE_RATES.items():
+        if rate is None:
+            continue
+        _, duration = throttle.parse_rate(rate)
+        window = int(now // duration)
+        key = get_throttle_key(scope, ident)
+        keys += [f"{key}:{window}", f"{key}:{window - 1}"]
+    throttle.cache.delete_many(keys)
+
+
+class RateThrottle(SimpleRateThrottle):
+    """
+    Ограничение частоты запросов скользящим окном: для каждого клиента
+    хранятся только два счетчика - текущего и предыдущего окна. Число
+    запросов за последние duration секунд оценивается как счетчик
+    текущего окна плюс доля счетчика предыдущего, еще попадающая
+    в интервал. Счетчики увеличиваются атомарно (incr) в кэше
+    THROTTLE_CACHE_ALIAS, поэтому с Redis ограничение общее для всех
+    процессов и серверов.
+
+    Частота берется из DEFAULT_THROTTLE_RATES по throttle_scope
+    представления (например, 'login', 'catalog'), для остальных
+    представлений - по 'user' или 'anon'.
+    """
+
+    def __init__(self):
+        # частота зависит от представления и задается в allow_request
+        self.rate = self.num_requests = self.duration = None
+        self.cache = get_throttle_cache()
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        return 'user' if request.user and request.user.is_authenticated \
+            else 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = get_user_ident(request.user.pk)
+        else:
+            ident = f"ip:{self.get_ident(request)}"
+        return get_throttle_key(self.scope, ident)
+
+    def allow_request(self, request, view):
+        self.scope = self.get_scope(request, view)
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        key = self.get_cache_key(request, view)
+        current_key = f"{key}:{window}"
+        self.previous = self.cache.get(f"{key}:{window - 1}", 0)
+        # доля предыдущего окна, попадающая в последние duration секунд
+        self.previous_share = 1 - (self.now % self.duration) / self.duration
+
+        # счетчик хранится два окна: в следующем окне он предыдущий
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            self.current = self.cache.incr(current_key)
+        except ValueError:
+            # счетчик вытеснен из кэша между add и incr
+            self.current = 1
+            self.cache.set(current_key, 1, self.duration * 2)
+
+        if self.previous * self.previous_share + self.current \
+                > self.num_requests:
+            # отклоненный запрос не учитывается
+            self.current -= 1
+            try:
+                self.cache.decr(current_key)
+            except ValueError:
+                pass
+            return False
+        return True
+
+    def wait(self):
+        """
+        Секунды до момента, когда запрос будет разрешен
+        """
+        if self.num_requests is None:
+            return None
+        remaining = self.duration - self.now % self.duration
+        available = self.num_requests - self.current - 1
+        if available >= 0 and self.previous:
+            # ждать, пока доля предыдущего окна не уменьшится
+            share = available / self.previous
+            return max(0.0, remaining - self.duration * share)
+        # в следующем окне текущий счетчик станет предыдущим
+        if self.current < self.num_requests:
+            return remaining
+        share = 1 - (self.num_requests - 1) / self.current
+        return remaining + self.duration * share
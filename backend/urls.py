@@ -3,6 +3,7 @@ from django_rest_passwordreset.views import reset_password_request_token, \
     reset_password_confirm
 from rest_framework.routers import DefaultRouter
 
+from .async_views import as_view
 from .views import PartnerViewSet, UserViewSet, AddressViewSet
 from .views import CategoryView, ShopView, ProductInfoView, BasketView, \
     OrderView
@@ -16,9 +17,9 @@ urlpatterns = [
     path('user/password_reset/', reset_password_request_token, name='password-reset'),
     path('user/password_reset/confirm/', reset_password_confirm, name='password-reset-confirm'),
 
-    path('categories/', CategoryView.as_view(), name='categories'),
-    path('shops/', ShopView.as_view(), name='shops'),
-    path('products/', ProductInfoView.as_view(), name='products'),
-    path('basket/', BasketView.as_view(), name='basket'),
-    path('order/', OrderView.as_view(), name='order'),
+    path('categories/', as_view(CategoryView), name='categories'),
+    path('shops/', as_view(ShopView), name='shops'),
+    path('products/', as_view(ProductInfoView), name='products'),
+    path('basket/', as_view(BasketView), name='basket'),
+    path('order/', as_view(OrderView), name='order'),
 ] + router.urls
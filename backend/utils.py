@@ -0,0 +1,13 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    Разбивает последовательность на списки длиной не больше size
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -12,23 +12,77 @@ from rest_framework import status, fields
 from rest_framework.generics import ListAPIView
 from rest_framework.views import APIView
 from django.conf import settings
-from django.db import IntegrityError
-from django.db.models import Sum, F, Q
+from django.db import IntegrityError, connection
+from django.db.models import Sum, F, Q, Prefetch, Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 import datetime
 from distutils.util import strtobool
 
 
-from .models import User, ConfirmEmailToken, ProductInfo, Shop, Address, Order,\
-                    OrderItem, Delivery, Category
+from .models import User, ConfirmEmailToken, Shop, Address, Order,\
+                    OrderItem, Delivery, Category, ImportJob, ProductParameter, \
+                    CatalogEntry
+from .basket import CheckoutError, add_basket_items, \
+    find_missing_product_infos, get_basket_totals, merge_items, \
+    place_order, update_basket_items
+from .cache import bump_catalog_version, cache_response
+from .catalog import refresh_catalog_shop
+from .pagination import KeysetPagination
 from .permissions import IsShop
 from .serializers import (UserSerializer, PartnerSerializer, ShopSerializer, 
-                          OrderItemSerializer, PartnerOrderSerializer, 
-                          OrderSerializer, ProductInfoSerializer,
+                          PartnerOrderSerializer, OrderSerializer,
                           DeliverySerializer, AddressSerializer,
-                          CategorySerializer, ShopOrderSerializer,
-                          UserWithPasswordSerializer)
-from .tasks import send_email_task
+                          CategorySerializer,
+                          UserWithPasswordSerializer, ImportJobSerializer,
+                          CatalogEntrySerializer, BasketItemSerializer)
+from .price_list import get_file_digest
+from .tasks import notify_admin, send_email_task
+
+
+def ordered_items_prefetch():
+    """
+    Позиции заказов с информацией о продуктах, магазинах и параметрах
+    для OrderSerializer и PartnerOrderSerializer: три запроса
+    на любое количество заказов
+    """
+    return [
+        Prefetch('ordered_items', queryset=OrderItem.objects.select_related(
+            'product_info__shop', 'product_info__product__category'
+        )),
+        'ordered_items__product_info__product_parameters__parameter',
+    ]
+
+
+def filter_orders(queryset, query_params):
+    """
+    Фильтры списка заказов: state (через запятую), date_from и date_to
+    (дата или дата и время). При неверной дате возникает ValueError.
+    """
+    state = query_params.get('state')
+    if state:
+        queryset = queryset.filter(state__in=state.split(','))
+
+    for param, lookup in (('date_from', 'dt__gte'), ('date_to', 'dt__lte')):
+        value = query_params.get(param)
+        if not value:
+            continue
+        dt = parse_datetime(value)
+        if dt is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError(f'Неправильно указан параметр {param}')
+            # дата без времени включает весь день
+            dt = datetime.datetime.combine(
+                date,
+                datetime.time.min if param == 'date_from'
+                else datetime.time.max
+            )
+        if timezone.is_naive(dt):
+            dt = timezone.make_aware(dt)
+        queryset = queryset.filter(**{lookup: dt})
+    return queryset
 
 
 class UserViewSet(viewsets.GenericViewSet):
@@ -38,9 +92,12 @@ class UserViewSet(viewsets.GenericViewSet):
     queryset = User.objects.filter(type='buyer')
     serializer_class = UserSerializer
     permission_classes = []
+    # область ограничения частоты задается для отдельных действий
+    throttle_scope = None
 
 
-    @action(methods=['post'], detail=False, permission_classes=[])
+    @action(methods=['post'], detail=False, permission_classes=[],
+            throttle_scope='register')
     def register(self, request, *args, **kwargs):
         """
         Регистрация покупателей
@@ -95,7 +152,8 @@ class UserViewSet(viewsets.GenericViewSet):
                 )
 
     
-    @action(methods=['post'], detail=False, url_path='register/confirm')
+    @action(methods=['post'], detail=False, url_path='register/confirm',
+            throttle_scope='login')
     def register_confirm(self, request, *args, **kwargs):
         """
         Подтверждение почтового адреса
@@ -126,7 +184,7 @@ class UserViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-    @action(methods=['post'], detail=False)
+    @action(methods=['post'], detail=False, throttle_scope='login')
     def login(self, request, *args, **kwargs):
         """
         Авторизация пользователей
@@ -215,47 +273,127 @@ class CategoryView(ListAPIView):
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    throttle_scope = 'catalog'
+
+    @cache_response
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class ShopView(ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
-    queryset = Shop.objects.filter(state=True)
+    queryset = Shop.objects.filter(state=True).prefetch_related('delivery')
     serializer_class = ShopSerializer
+    throttle_scope = 'catalog'
+
+    @cache_response
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 class ProductInfoView(APIView):
     """
     Класс для поиска товаров
     """
-    queryset = ProductInfo.objects.none()
-    serializer_class = ProductInfoSerializer
-
+    queryset = CatalogEntry.objects.none()
+    serializer_class = CatalogEntrySerializer
+    throttle_scope = 'catalog'
+
+    # значения параметра ordering и соответствующие поля сортировки
+    ORDERING_FIELDS = {
+        'id': 'product_info_id',
+        'price': 'price',
+        'name': 'product_name',
+    }
+
+    @cache_response
     def get(self, request, *args, **kwargs):
+        """
+        Поиск товаров с постраничным выводом (параметры cursor и limit).
 
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
+        Фильтры: shop_id, category_id, search (по названию и модели),
+        price_min, price_max, in_stock, parameter=<имя>:<значение>
+        (можно указать несколько). Сортировка: ordering=id, price, name,
+        с минусом - по убыванию.
 
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
+        Товары читаются из денормализованного каталога CatalogEntry,
+        ответы кэшируются до изменения версии каталога.
+        """
 
-        if category_id:
-            query = query & Q(product__category_id=category_id)
+        try:
+            query = self.get_filter(request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-        # фильтруем дубликаты
-        queryset = ProductInfo.objects.filter(
-            query
-        ).select_related(
-            'shop', 'product__category'
-        ).prefetch_related(
-            'product_parameters__parameter'
-        ).distinct()
+        ordering = request.query_params.get('ordering', 'id')
+        field = self.ORDERING_FIELDS.get(ordering.lstrip('-'))
+        if field is None:
+            return JsonResponse(
+                {'Status': False,
+                 'Errors': 'Неправильно указан параметр ordering'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        direction = '-' if ordering.startswith('-') else ''
+        ordering = (direction + field,)
+        if field != 'product_info_id':
+            ordering += (direction + 'product_info_id',)
+
+        queryset = CatalogEntry.objects.filter(query)
+
+        paginator = KeysetPagination(ordering=ordering)
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = CatalogEntrySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def get_filter(query_params):
+        query = Q(shop_state=True)
+
+        for param, lookup in (('shop_id', 'shop_id'),
+                              ('category_id', 'category_id'),
+                              ('price_min', 'price__gte'),
+                              ('price_max', 'price__lte')):
+            value = query_params.get(param)
+            if value:
+                try:
+                    query &= Q(**{lookup: int(value)})
+                except ValueError:
+                    raise ValueError(f'Неправильно указан параметр {param}')
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        search = query_params.get('search', '').strip()
+        if search:
+            query &= (Q(product_name__icontains=search)
+                      | Q(model__icontains=search))
 
-        return Response(serializer.data)
+        in_stock = query_params.get('in_stock')
+        if in_stock:
+            try:
+                if strtobool(in_stock):
+                    query &= Q(quantity__gt=0)
+            except ValueError:
+                raise ValueError('Неправильно указан параметр in_stock')
+
+        for parameter in query_params.getlist('parameter'):
+            name, separator, value = parameter.partition(':')
+            if not separator:
+                raise ValueError('Параметр parameter указывается '
+                                 'в виде <имя>:<значение>')
+            if connection.vendor == 'postgresql':
+                # параметры хранятся в самой записи каталога,
+                # отбор по индексу catalog_parameters_idx
+                query &= Q(parameters__contains=[{'parameter': name,
+                                                  'value': value}])
+            else:
+                query &= Q(Exists(ProductParameter.objects.filter(
+                    product_info_id=OuterRef('product_info_id'),
+                    parameter__name=name,
+                    value=value
+                )))
+
+        return query
 
 
 class BasketView(APIView):
@@ -274,9 +412,9 @@ class BasketView(APIView):
         basket = Order.objects.filter(
             user_id=request.user.id, state='basket'
         ).prefetch_related(
-            'ordered_items__product_info__shop',
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
+            *ordered_items_prefetch()
+        ).select_related(
+            'address'
         ).annotate(
             total_sum=Sum(F('ordered_items__quantity') *
                           F('ordered_items__product_info__price'))
@@ -288,7 +426,9 @@ class BasketView(APIView):
    
     def post(self, request, *args, **kwargs):
         """
-        Добавить позиции в корзину
+        Добавить позиции в корзину.
+        Все позиции проверяются до записи и добавляются одной транзакцией,
+        количество у позиций, уже лежащих в корзине, увеличивается.
         """
 
         items_list = request.data.get('items')
@@ -299,31 +439,35 @@ class BasketView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        basket, _ = Order.objects.get_or_create(
-            user_id=request.user.id, state='basket'
-        )
-        objects_created = 0
-        for order_item in items_list:
-            order_item.update({'order': basket.id})
-            serializer = OrderItemSerializer(data=order_item)
-            if serializer.is_valid():
-                try:
-                    serializer.save()
-                except IntegrityError as error:
-                    return JsonResponse(
-                        {'Status': False, 'Errors': str(error)},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                else:
-                    objects_created += 1
-            else:
-                return JsonResponse(
-                    {'Status': False, 'Errors': serializer.errors},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        serializer = BasketItemSerializer(data=items_list, many=True)
+        if not serializer.is_valid():
+            return JsonResponse(
+                {'Status': False, 'Errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
+        quantities = merge_items(serializer.validated_data)
+        missing = find_missing_product_infos(quantities)
+        if missing:
+            return JsonResponse(
+                {'Status': False,
+                 'Errors': f"Нет информации о продуктах: "
+                           f"{', '.join(map(str, missing))}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            objects_created, objects_updated = add_basket_items(
+                request.user.id, quantities
+            )
+        except IntegrityError as error:
+            return JsonResponse(
+                {'Status': False, 'Errors': str(error)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return JsonResponse(
-            {'Status': True, 'Создано объектов': objects_created}
+            {'Status': True, 'Создано объектов': objects_created,
+             'Обновлено объектов': objects_updated}
         )
 
  
@@ -331,6 +475,8 @@ class BasketView(APIView):
         """
         Изменить в корзине количество у указанных позиций.
         Если новое количество равно 0, то позиция будет удалена из корзины.
+        Изменения записываются одной транзакцией, в ответе возвращаются
+        итоги корзины (total_sum и total_delivery).
         """
 
         items_list = request.data.get('items')
@@ -350,31 +496,19 @@ class BasketView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        objects_updated, deleted_count = 0, 0
-        query = Q()
-        has_objects_to_delete = False
-
+        quantities = {}
         for order_item in items_list:
             item_id, qty = order_item.get('id'), order_item.get('quantity')
+            if type(item_id) == int and type(qty) == int and qty >= 0:
+                quantities[item_id] = qty
 
-            if type(item_id) == int and type(qty) == int:
-                if qty == 0:
-                    query = query | Q(order_id=basket.id, id=item_id)
-                    has_objects_to_delete = True
-                else:
-                    objects_updated += OrderItem.objects.filter(
-                        order_id=basket.id, id=item_id
-                    ).update(
-                        quantity=qty
-                    )
-
-        if has_objects_to_delete:
-            deleted_count, _ = OrderItem.objects.filter(query).delete()
-
+        objects_updated, deleted_count = update_basket_items(basket.id,
+                                                             quantities)
         if objects_updated or deleted_count:
             return JsonResponse(
                 {'Status': True, 'Обновлено объектов': objects_updated,
-                 'Удалено объектов': deleted_count}
+                 'Удалено объектов': deleted_count,
+                 **get_basket_totals(basket.id)}
             )
         else:
             return JsonResponse(
@@ -393,7 +527,9 @@ class OrderView(APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Получить мои заказы
+        Получить мои заказы.
+        Заказы выводятся постранично от новых к старым (параметры cursor
+        и limit), фильтры: state, date_from, date_to.
         """
 
         order = Order.objects.filter(
@@ -401,67 +537,34 @@ class OrderView(APIView):
         ).exclude(
             state='basket'
         ).prefetch_related(
-            'ordered_items__product_info__shop',
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
+            *ordered_items_prefetch()
         ).select_related(
             'address'
         ).annotate(
             total_sum=Sum(F('ordered_items__quantity')
                           * F('ordered_items__product_info__price'))
         ).distinct()
+        try:
+            order = filter_orders(order, request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(order, request, view=self)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     
     def post(self, request, *args, **kwargs):
         """
         Разместить заказ из корзины с указанным адресом доставки.
+        Остатки товаров проверяются и уменьшаются в одной транзакции
+        со сменой статуса заказа.
         Затем отправить почту администратору о новом заказе
         и клиенту об изменении статуса заказа.
         """
 
-        try:
-            basket = Order.objects.get(user_id=request.user.id, state='basket')
-        except Order.DoesNotExist:
-            return JsonResponse(
-                {'Status': False,
-                 'Errors': 'Нет заказа со статусом корзины'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        invalid_deliveries = []
-        shops = Shop.objects.filter(
-            product_infos__ordered_items__order=basket.id
-        ).prefetch_related(
-            'product_infos__product__category',
-            'product_infos__product_parameters__parameter'
-
-        ).annotate(
-            shop_sum=Sum(F('product_infos__ordered_items__quantity')
-                         * F('product_infos__price'))
-        ).distinct()
-        for shop in shops:
-            shop_data = ShopOrderSerializer(shop, order_id=basket.id).data
-            shop_deliveries = Delivery.objects.filter(shop=shop)
-            if not shop_deliveries:
-                invalid_deliveries.append(f"{shop_data['name']}: "
-                                          f"стоимость доставки недоступна.")
-            else:
-                shop_delivery = shop_deliveries.filter(
-                    min_sum__lte=shop_data['shop_sum']
-                ).order_by('-min_sum').first()
-                if shop_delivery is None:
-                    invalid_deliveries.append(
-                        f"{shop_data['name']}: сумма заказа меньше минимальной"
-                    )
-        if invalid_deliveries:
-            return JsonResponse(
-                {'Status': False, 'Errors': invalid_deliveries},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
         address_id = request.data.get('address_id')
         if not address_id:
             return JsonResponse(
@@ -477,12 +580,10 @@ class OrderView(APIView):
             )
 
         try:
-            basket.address_id = address_id
-            basket.state = 'new'
-            basket.save()
-        except IntegrityError:
+            basket = place_order(request.user.id, address_id)
+        except CheckoutError as error:
             return JsonResponse(
-                {'Status': False, 'Errors': 'Адрес не найден'},
+                {'Status': False, 'Errors': error.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
         else:
@@ -492,12 +593,11 @@ class OrderView(APIView):
             addressee_list = [basket.user.email]
             send_email_task(title, message, addressee_list)
 
-            # отправляем письмо администратору о новом заказе
+            # уведомляем администратора о новом заказе
             title = f"Новый заказ от {basket.user}"
             message = (f'Пользователем {basket.user} оформлен '
                        f'новый заказ {basket.id}.')
-            addressee_list = [settings.ADMIN_EMAIL]
-            send_email_task(title, message, addressee_list)
+            notify_admin('new_order', title, message)
 
             return JsonResponse({'Status': True})
 
@@ -510,9 +610,11 @@ class PartnerViewSet(viewsets.GenericViewSet):
     queryset = User.objects.filter(type='shop')
     serializer_class = PartnerSerializer
     permission_classes = [IsAuthenticated, IsShop]
+    throttle_scope = None
 
     
-    @action(methods=['post'], detail=False, permission_classes=[])
+    @action(methods=['post'], detail=False, permission_classes=[],
+            throttle_scope='register')
     def register(self, request):
         """
         Регистрация поставщика.
@@ -600,16 +702,23 @@ class PartnerViewSet(viewsets.GenericViewSet):
         shop, created = Shop.objects.get_or_create(user_id=request.user.id)
         if created:
             data['name'] = f"- Актуализируйте прайс-лист -"
+        elif (file and shop.is_uptodate and shop.price_list_digest
+              and get_file_digest(file) == shop.price_list_digest):
+            # файл совпадает с уже загруженным прайс-листом
+            return JsonResponse({'Status': True,
+                                 'Message': 'Прайс-лист не изменился'})
+        elif shop.url != url:
+            # заголовки условных запросов относятся к прежней ссылке
+            shop.url_etag, shop.url_last_modified = '', ''
         shop_serializer = ShopSerializer(shop, data=data, partial=True)
         if shop_serializer.is_valid():
             shop_serializer.save()
 
-            # отправляем письмо администратору о новом прайс-листе
+            # уведомляем администратора о новом прайс-листе
             title = f"{shop_serializer.data['name']}: обновление прайса"
             message = (f"Пользователь {request.user} сообщил о новом "
                        f"прайс-листе магазина {shop_serializer.data['name']}")
-            addressee_list = [settings.ADMIN_EMAIL]
-            send_email_task(title, message, addressee_list)
+            notify_admin('price_list', title, message)
 
             return JsonResponse({'Status': True})
         else:
@@ -618,6 +727,27 @@ class PartnerViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False)
+    def imports(self, request):
+        """
+        Просмотр заданий на загрузку прайс-листа и их прогресса.
+        С параметром id возвращается одно задание.
+        """
+
+        jobs = ImportJob.objects.filter(shop__user_id=request.user.id)
+        job_id = request.query_params.get('id')
+        if job_id:
+            job = jobs.filter(id=job_id).first()
+            if job is None:
+                return JsonResponse(
+                    {'Status': False, 'Errors': 'Задание не найдено'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            return Response(ImportJobSerializer(job).data)
+
+        serializer = ImportJobSerializer(jobs, many=True)
+        return Response(serializer.data)
+
     @action(methods=['get', 'post'], detail=False)
     def state(self, request):
         """
@@ -651,6 +781,11 @@ class PartnerViewSet(viewsets.GenericViewSet):
                 ).update(
                     state=strtobool(state)
                 )
+                for shop_id in Shop.objects.filter(
+                    user_id=request.user.id
+                ).values_list('id', flat=True):
+                    refresh_catalog_shop(shop_id)
+                bump_catalog_version()
                 return JsonResponse({'Status': True})
             except ValueError as error:
                 return JsonResponse(
@@ -662,7 +797,9 @@ class PartnerViewSet(viewsets.GenericViewSet):
     @action(detail=False)
     def orders(self, request):
         """
-        Просмотр заказов поставщика
+        Просмотр заказов поставщика.
+        Заказы выводятся постранично от новых к старым (параметры cursor
+        и limit), фильтры: state, date_from, date_to.
         """
 
         order = Order.objects.filter(
@@ -670,19 +807,24 @@ class PartnerViewSet(viewsets.GenericViewSet):
         ).exclude(
             state='basket'
         ).prefetch_related(
-            'ordered_items__product_info__shop',
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
+            *ordered_items_prefetch()
         ).select_related(
-            'user'
+            'user', 'address'
         ).annotate(
             total_sum=Sum(F('ordered_items__quantity') *
                           F('ordered_items__product_info__price'))
         ).distinct()
+        try:
+            order = filter_orders(order, request.query_params)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = PartnerOrderSerializer(order, partner_id=request.user.id,
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(order, request, view=self)
+        serializer = PartnerOrderSerializer(page, partner_id=request.user.id,
                                             many=True)
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(methods=['get', 'post'], detail=False)
     def delivery(self, request):
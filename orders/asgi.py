@@ -0,0 +1,18 @@
+"""
+ASGI config for orders project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Catalog, basket and order views are served asynchronously (ASYNC_VIEWS).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'orders.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
+application = get_asgi_application()
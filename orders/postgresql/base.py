@@ -0,0 +1,213 @@
+"""
+Бэкенд PostgreSQL с проверкой сохраненных соединений (CONN_HEALTH_CHECKS)
+и необязательным пулом соединений процесса (POOL):
+
+    'ENGINE': 'orders.postgresql',
+    'CONN_MAX_AGE': 60,
+    'CONN_HEALTH_CHECKS': True,
+    'POOL': {'MAX_SIZE': 20, 'TIMEOUT': 10},
+
+С пулом соединение после запроса возвращается в пул, а не закрывается
+(CONN_MAX_AGE должен быть 0). Если все MAX_SIZE соединений заняты,
+поток ждет освободившееся не дольше TIMEOUT секунд.
+"""
+import os
+import threading
+import time
+import weakref
+
+from django.db.backends.postgresql.base import \
+    DatabaseWrapper as PostgresDatabaseWrapper, Database
+from psycopg2 import extensions
+
+
+def ping(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Database.Error:
+        return False
+    return True
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Database.Error:
+        pass
+
+
+class ConnectionPool:
+    """
+    Открытые соединения psycopg2, не занятые потоками процесса
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.idle = []
+        # открытых соединений: свободных и занятых
+        self.size = 0
+
+    def acquire(self, health_check):
+        """
+        Свободное соединение из пула или None, если можно открыть новое
+        (место для него уже занято, при ошибке открытия вызвать discard)
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle:
+                    if self.size < self.max_size:
+                        self.size += 1
+                        return None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Database.OperationalError(
+                            f"Нет свободных соединений в пуле "
+                            f"({self.max_size}) за {self.timeout} с"
+                        )
+                    self.condition.wait(remaining)
+                connection = self.idle.pop()
+            if not connection.closed \
+                    and (not health_check or ping(connection)):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection):
+        status = connection.info.transaction_status \
+            if not connection.closed else None
+        if status in (extensions.TRANSACTION_STATUS_INTRANS,
+                      extensions.TRANSACTION_STATUS_INERROR):
+            try:
+                connection.rollback()
+            except Database.Error:
+                status = None
+            else:
+                status = extensions.TRANSACTION_STATUS_IDLE
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def discard(self, connection=None):
+        if connection is not None:
+            close_quietly(connection)
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for connection in idle:
+            close_quietly(connection)
+
+
+# пулы по (алиас базы, pid): после fork процесс создает свой пул,
+# унаследованные соединения не используются и не закрываются
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings):
+    key = (alias, os.getpid())
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(settings.get('MAX_SIZE', 20),
+                                        settings.get('TIMEOUT', 10))
+        return pools[key]
+
+
+def close_pools():
+    """
+    Закрывает свободные соединения всех пулов процесса
+    """
+    with pools_lock:
+        current = [pool for (_, pid), pool in pools.items()
+                   if pid == os.getpid()]
+    for pool in current:
+        pool.close()
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pool_finalizer = None
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    @property
+    def pool(self):
+        if not self.settings_dict.get('POOL'):
+            return None
+        return get_pool(self.alias, self.settings_dict['POOL'])
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        connection = pool.acquire(self.health_check_enabled)
+        if connection is None:
+            try:
+                connection = super().get_new_connection(conn_params)
+            except Exception:
+                pool.discard()
+                raise
+        else:
+            self.isolation_level = self.settings_dict['OPTIONS'].get(
+                'isolation_level', connection.isolation_level
+            )
+        # если поток завершился, не закрыв соединение (обертка хранится
+        # в данных потока и удаляется вместе с ним), соединение
+        # возвращается в пул, иначе его место в пуле было бы потеряно
+        self.pool_finalizer = weakref.finalize(self, pool.release,
+                                               connection)
+        self.pool_finalizer.atexit = False
+        return connection
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def _close(self):
+        if self.pool_finalizer is not None:
+            self.pool_finalizer.detach()
+            self.pool_finalizer = None
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # соединение внутри транзакции остается у обертки
+                # до отката, вернуть его в пул нельзя
+                pool.discard(self.connection)
+            else:
+                pool.release(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        # сохраненное соединение проверяется перед первым запросом
+        # следующего HTTP-запроса
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        if self.connection is None or not self.health_check_enabled \
+                or self.health_check_done or self.in_atomic_block:
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger('orders.profiling')
+
+# списки значений (IN (%s, %s), VALUES (%s, %s), (%s, %s)) и числа
+# в тексте запроса заменяются, чтобы запросы, различающиеся только
+# значениями, имели одинаковый отпечаток
+VALUES_LIST_RE = re.compile(r'\((?:%s, )*%s\)(?:, \((?:%s, )*%s\))*')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+
+def get_fingerprint(sql):
+    return NUMBER_RE.sub('N', VALUES_LIST_RE.sub('(...)', sql))
+
+
+class QueryRecorder:
+    """
+    Запросы к базе, выполненные при обработке одного HTTP-запроса:
+    вызывается из record_query, подключенной ко всем базам
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.fingerprints = Counter()
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[get_fingerprint(sql)] += 1
+            self.statements.append((duration, sql))
+
+    def get_duplicates(self):
+        """
+        Запросы, повторенные не меньше QUERY_PROFILING_DUPLICATES раз
+        (обычно N+1): словарь отпечаток -> количество
+        """
+        return {fingerprint: count
+                for fingerprint, count in self.fingerprints.items()
+                if count >= settings.QUERY_PROFILING_DUPLICATES}
+
+    def get_slowest(self):
+        return sorted(self.statements, key=lambda statement: statement[0],
+                      reverse=True)[:settings.QUERY_PROFILING_TOP]
+
+
+# регистратор запросов текущего HTTP-запроса. Переменная контекста
+# передается в потоки sync_to_async, поэтому учитываются и запросы
+# асинхронных представлений (ASGI), выполняемые в других потоках.
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def add_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorder():
+    """
+    Подключает record_query ко всем базам текущего потока
+    """
+    if settings.QUERY_PROFILING:
+        for connection in connections.all():
+            add_query_recorder(connection)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # соединения потоков, в которых выполняются синхронные
+    # представления под ASGI
+    if settings.QUERY_PROFILING:
+        add_query_recorder(connection)
+
+
+class QueryStats:
+    """
+    Статистика запросов к базе по маршрутам API в памяти процесса
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def add(self, route, recorder, duration):
+        slowest = [(round(statement_duration * 1000, 2), sql)
+                   for statement_duration, sql in recorder.get_slowest()]
+        with self.lock:
+            stats = self.routes.setdefault(route, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time_ms': 0, 'max_db_time_ms': 0, 'time_ms': 0,
+                'duplicates': Counter(), 'slowest': [],
+            })
+            db_time = recorder.duration * 1000
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['db_time_ms'] += db_time
+            stats['max_db_time_ms'] = max(stats['max_db_time_ms'], db_time)
+            stats['time_ms'] += duration * 1000
+            stats['duplicates'].update(recorder.get_duplicates())
+            stats['slowest'] = sorted(
+                stats['slowest'] + slowest, reverse=True
+            )[:settings.QUERY_PROFILING_TOP]
+
+    def get_report(self):
+        with self.lock:
+            return {
+                route: {
+                    'requests': stats['requests'],
+                    'avg_queries': round(stats['queries'] / stats['requests'],
+                                         1),
+                    'max_queries': stats['max_queries'],
+                    'avg_db_time_ms': round(
+                        stats['db_time_ms'] / stats['requests'], 2
+                    ),
+                    'max_db_time_ms': round(stats['max_db_time_ms'], 2),
+                    'avg_time_ms': round(stats['time_ms'] / stats['requests'],
+                                         2),
+                    'duplicates': [
+                        {'sql': fingerprint, 'count': count}
+                        for fingerprint, count
+                        in stats['duplicates'].most_common(
+                            settings.QUERY_PROFILING_TOP
+                        )
+                    ],
+                    'slowest': [{'time_ms': duration, 'sql': sql}
+                                for duration, sql in stats['slowest']],
+                }
+                for route, stats in self.routes.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+
+query_stats = QueryStats()
+
+
+def get_route(request):
+    match = request.resolver_match
+    return f"{request.method} /{match.route if match else '<unresolved>'}"
+
+
+class QueryProfilingMiddleware:
+    """
+    Профилирование запросов к базе (включается QUERY_PROFILING=True):
+    для доли QUERY_PROFILING_SAMPLE_RATE HTTP-запросов считает количество
+    и время запросов к базе, повторяющиеся запросы и самые медленные.
+    Результат пишется в журнал orders.profiling, добавляется в статистику
+    по маршрутам (QueryMetricsView), а при DEBUG - в заголовки ответа.
+    Работает и с асинхронными представлениями (ASGI), не выполняя
+    запросы по очереди.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if random.random() >= settings.QUERY_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        install_query_recorder()
+        token = current_recorder.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.process(request, response, recorder,
+                            time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.QUERY_PROFILING_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        token = current_recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.process(request, response, recorder,
+                            time.perf_counter() - started)
+
+    def process(self, request, response, recorder, duration):
+        route = get_route(request)
+        query_stats.add(route, recorder, duration)
+        self.log(request, route, response, recorder, duration)
+        if settings.DEBUG:
+            response['X-DB-Queries'] = recorder.count
+            response['X-DB-Time'] = f"{recorder.duration * 1000:.2f}ms"
+            response['X-DB-Duplicates'] = len(recorder.get_duplicates())
+        return response
+
+    @staticmethod
+    def log(request, route, response, recorder, duration):
+        duplicates = recorder.get_duplicates()
+        record = {
+            'route': route,
+            'path': request.path,
+            'status': response.status_code,
+            'time_ms': round(duration * 1000, 2),
+            'queries': recorder.count,
+            'db_time_ms': round(recorder.duration * 1000, 2),
+            'duplicates': [{'sql': fingerprint, 'count': count}
+                           for fingerprint, count in duplicates.items()],
+        }
+        slow = [{'time_ms': round(statement_duration * 1000, 2), 'sql': sql}
+                for statement_duration, sql in recorder.get_slowest()
+                if statement_duration * 1000
+                >= settings.QUERY_PROFILING_SLOW_MS]
+        if slow:
+            record['slow'] = slow
+        level = logging.WARNING if slow or duplicates else logging.INFO
+        logger.log(level, json.dumps(record, ensure_ascii=False))
+
+
+class QueryMetricsView(APIView):
+    """
+    Статистика запросов к базе по маршрутам API в текущем процессе
+    (только для администраторов). DELETE сбрасывает статистику.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'enabled': settings.QUERY_PROFILING,
+            'sample_rate': settings.QUERY_PROFILING_SAMPLE_RATE,
+            'routes': query_stats.get_report(),
+        })
+
+    def delete(self, request, *args, **kwargs):
+        query_stats.reset()
+        return Response(status=204)
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# чтение с реплик разрешается только на время безопасных HTTP-запросов
+# (ReplicaMiddleware), задачи celery и команды читают с основной базы
+use_replicas = ContextVar('use_replicas', default=False)
+
+# модели, которые всегда читаются с основной базы: токен, полученный
+# при входе, нужен в следующем запросе, когда реплика могла
+# еще не получить его
+PRIMARY_MODELS = {'authtoken.token'}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@contextmanager
+def primary():
+    """
+    Чтение с основной базы внутри блока, например для данных, которые
+    кэшируются до следующего изменения
+    """
+    token = use_replicas.set(False)
+    try:
+        yield
+    finally:
+        use_replicas.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Запись - в основную базу, чтение при use_replicas - со случайной
+    реплики из DATABASE_REPLICAS. Внутри транзакции основной базы
+    чтение идет из нее же.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not use_replicas.get() \
+                or model._meta.label_lower in PRIMARY_MODELS \
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема реплик обновляется репликацией
+        return db not in settings.DATABASE_REPLICAS
+
+
+def get_pin_cache():
+    return caches[settings.REPLICA_CACHE_ALIAS]
+
+
+def set_pin(pin_key):
+    get_pin_cache().set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(pin_key):
+    return bool(get_pin_cache().get(pin_key))
+
+
+def get_pin_key(request):
+    """
+    Ключ закрепления клиента за основной базой: по токену или сессии,
+    для анонимного клиента - None
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') \
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'replica_pin:' + hashlib.md5(credentials.encode()).hexdigest()
+
+
+class ReplicaMiddleware:
+    """
+    Разрешает чтение с реплик для GET, HEAD и OPTIONS. После изменяющего
+    запроса клиент на REPLICA_PIN_SECONDS секунд закрепляется
+    за основной базой, чтобы видеть свои изменения (корзину, заказы),
+    пока реплики их не получили. Закрепление хранится в кэше
+    REPLICA_CACHE_ALIAS: следующий запрос клиента может обработать
+    другой процесс, поэтому кэш в памяти процесса не допускается.
+    Работает и с асинхронными представлениями (ASGI).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        if isinstance(get_pin_cache(), LocMemCache):
+            raise ImproperlyConfigured(
+                'Для чтения с реплик нужен общий для всех процессов кэш '
+                'закрепления клиентов (REPLICA_CACHE_URL, например Redis)'
+            )
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        pin_key = get_pin_key(request)
+        if request.method not in SAFE_METHODS:
+            try:
+                return self.get_response(request)
+            finally:
+                if pin_key:
+                    set_pin(pin_key)
+
+        if pin_key and is_pinned(pin_key):
+            return self.get_response(request)
+
+        token = use_replicas.set(True)
+        try:
+            return self.get_response(request)
+        finally:
+            use_replicas.reset(token)
+
+    async def __acall__(self, request):
+        pin_key = get_pin_key(request)
+        if request.method not in SAFE_METHODS:
+            try:
+                return await self.get_response(request)
+            finally:
+                if pin_key:
+                    await sync_to_async(set_pin, thread_sensitive=False)(
+                        pin_key
+                    )
+
+        if pin_key and await sync_to_async(
+            is_pinned, thread_sensitive=False
+        )(pin_key):
+            return await self.get_response(request)
+
+        # значение переменной контекста передается в потоки
+        # асинхронных представлений
+        token = use_replicas.set(True)
+        try:
+            return await self.get_response(request)
+        finally:
+            use_replicas.reset(token)
@@ -30,6 +30,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'orders.profiling.QueryProfilingMiddleware',
+    'orders.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,19 +61,52 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'orders.wsgi.application'
 
+# Асинхронные представления каталога, корзины и заказов (включается
+# в orders/asgi.py) и количество потоков для их запросов к базе
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+ASYNC_VIEW_THREADS = env.int('ASYNC_VIEW_THREADS', default=20)
+
 # Database
 
+# Соединения с базой сохраняются между запросами на DB_CONN_MAX_AGE
+# секунд (0 - закрываются после каждого запроса) и проверяются перед
+# первым запросом (DB_CONN_HEALTH_CHECKS). С DB_POOL=True соединения
+# берутся из пула процесса размером DB_POOL_MAX_SIZE, свободное
+# соединение ожидается не дольше DB_POOL_TIMEOUT секунд.
+DB_POOL = env.bool('DB_POOL', default=False)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'orders.postgresql',
         'NAME': env('POSTGRES_DB'),
         'USER': env('POSTGRES_USER'),
         'PASSWORD': env('POSTGRES_PASSWORD'),
         'HOST': env('POSTGRES_HOST'),
         'PORT': '5432',
+        'CONN_MAX_AGE': 0 if DB_POOL else env.int('DB_CONN_MAX_AGE',
+                                                  default=60),
+        'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS',
+                                       default=True),
+        'POOL': {
+            'MAX_SIZE': env.int('DB_POOL_MAX_SIZE', default=20),
+            'TIMEOUT': env.float('DB_POOL_TIMEOUT', default=10),
+        } if DB_POOL else None,
     }
 }
 
+# Реплики для чтения (DB_REPLICA_HOSTS=replica1,replica2) с теми же
+# именем базы и пользователем. Безопасные HTTP-запросы читают
+# со случайной реплики, клиент после изменяющего запроса читает
+# с основной базы REPLICA_PIN_SECONDS секунд. Закрепление хранится
+# в кэше REPLICA_CACHE_ALIAS, общем для всех процессов (Redis).
+DATABASE_REPLICAS = []
+for index, host in enumerate(env.list('DB_REPLICA_HOSTS', default=[]), 1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host,
+                                    'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['orders.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = env.int('DB_REPLICA_PIN_SECONDS', default=5)
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -115,27 +150,149 @@ DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 AUTH_USER_MODEL = 'backend.User'
 
-# TODO send real emails
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+# По умолчанию письма сохраняются в файлы в sent_emails, для отправки
+# через SMTP указать EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend
+EMAIL_BACKEND = env('EMAIL_BACKEND',
+                    default='django.core.mail.backends.filebased.EmailBackend')
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+EMAIL_HOST = env('EMAIL_HOST', default='localhost')
+EMAIL_PORT = env.int('EMAIL_PORT', default=25)
+EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = env.bool('EMAIL_USE_TLS', default=False)
 
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 ADMIN_EMAIL = env('ADMIN_EMAIL')
 
+# Очередь писем: размер пакета, количество попыток отправки,
+# задержка перед первой повторной попыткой и период проверки
+# очереди (секунды)
+EMAIL_BATCH_SIZE = env.int('EMAIL_BATCH_SIZE', default=100)
+EMAIL_MAX_ATTEMPTS = env.int('EMAIL_MAX_ATTEMPTS', default=5)
+EMAIL_RETRY_DELAY = env.int('EMAIL_RETRY_DELAY', default=60)
+EMAIL_DISPATCH_INTERVAL = env.int('EMAIL_DISPATCH_INTERVAL', default=60)
+# Сколько секунд письмо закреплено за обработчиком, который его
+# отправляет: если обработчик завершился, не сохранив результат,
+# после этого срока письмо отправляется повторно
+EMAIL_LEASE_SECONDS = env.int('EMAIL_LEASE_SECONDS', default=600)
+# Без брокера celery (CELERY_TASK_ALWAYS_EAGER) письма отправляются
+# в фоновом потоке, не задерживая ответ
+EMAIL_DISPATCH_BACKGROUND = env.bool('EMAIL_DISPATCH_BACKGROUND',
+                                     default=True)
+
+# Размер пакета при загрузке прайс-листов
+IMPORT_BATCH_SIZE = env.int('IMPORT_BATCH_SIZE', default=1000)
+# Количество одновременных загрузок прайс-листов по ссылкам
+# и время ожидания ответа (секунды)
+PRICE_LIST_FETCH_WORKERS = env.int('PRICE_LIST_FETCH_WORKERS', default=10)
+PRICE_LIST_FETCH_TIMEOUT = env.float('PRICE_LIST_FETCH_TIMEOUT', default=30)
+
+# Celery
+# Без брокера (CELERY_TASK_ALWAYS_EAGER=True) задачи выполняются сразу
+# в текущем процессе, что удобно для разработки и тестов.
+CELERY_BROKER_URL = env('CELERY_BROKER_URL',
+                        default='redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=True)
+# Повторная отправка отложенных писем (celery beat)
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-emails': {
+        'task': 'backend.tasks.dispatch_emails_task',
+        'schedule': EMAIL_DISPATCH_INTERVAL,
+    },
+    'send-admin-digests': {
+        'task': 'backend.tasks.send_admin_digests_task',
+        'schedule': 60,
+    },
+}
+
+# Уведомления администратора собираются в сводки: окно в секундах
+# для каждого типа событий (0 - отправлять каждое уведомление сразу).
+# Сводки отправляет celery beat, поэтому без брокера по умолчанию
+# уведомления отправляются сразу; с окнами без beat сводки отправляются
+# вместе с очередью писем и командой send_emails.
+ADMIN_DIGEST_WINDOWS = {
+    'new_order': env.int('ADMIN_DIGEST_NEW_ORDER',
+                         default=0 if CELERY_TASK_ALWAYS_EAGER else 60),
+    'price_list': env.int('ADMIN_DIGEST_PRICE_LIST',
+                          default=0 if CELERY_TASK_ALWAYS_EAGER else 3600),
+}
+
+# Кэш: по умолчанию в памяти процесса (LocMemCache, вытеснение LRU
+# при превышении MAX_ENTRIES), для нескольких процессов - Redis,
+# например CACHE_URL=rediscache://redis:6379/1
+# (вытеснение задается политикой maxmemory-policy allkeys-lru).
+CACHES = {
+    'default': env.cache('CACHE_URL',
+                         default='locmemcache://?max_entries=5000'),
+    # счетчики ограничения частоты запросов: для нескольких процессов
+    # и серверов - общий Redis,
+    # например THROTTLE_CACHE_URL=rediscache://redis:6379/2
+    'throttle': env.cache('THROTTLE_CACHE_URL',
+                          default='locmemcache://throttle'),
+    # закрепление клиентов за основной базой после записи: с репликами
+    # обязательно общий Redis, например
+    # REPLICA_CACHE_URL=rediscache://redis:6379/3
+    'replica': env.cache('REPLICA_CACHE_URL',
+                         default='locmemcache://replica'),
+}
+THROTTLE_CACHE_ALIAS = 'throttle'
+REPLICA_CACHE_ALIAS = 'replica'
+# Кэш ответов каталога (категории, магазины, товары) и время хранения,
+# только с общим кэшем (CACHE_URL), с кэшем в памяти процесса не используется
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=600)
+# Наибольшее время хранения уровней доставки в памяти процесса (только
+# с общим кэшем, с кэшем в памяти уровни читаются из базы)
+DELIVERY_INDEX_TIMEOUT = env.int('DELIVERY_INDEX_TIMEOUT', default=300)
+# Кэш проверенных токенов и время хранения. Токен удаляется из кэша
+# при изменении пользователя; с кэшем в памяти процесса (без CACHE_URL)
+# токены не кэшируются, так как удаление не видно другим процессам.
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = env.int('AUTH_TOKEN_CACHE_TIMEOUT', default=300)
+
+# Профилирование запросов к базе: доля профилируемых HTTP-запросов,
+# время медленного запроса (мс) для журнала, сколько повторов одного
+# запроса считать N+1 и сколько самых медленных запросов сохранять.
+# Статистика - /metrics/queries/, при DEBUG - заголовки X-DB-*.
+QUERY_PROFILING = env.bool('QUERY_PROFILING', default=False)
+QUERY_PROFILING_SAMPLE_RATE = env.float('QUERY_PROFILING_SAMPLE_RATE',
+                                        default=1.0)
+QUERY_PROFILING_SLOW_MS = env.float('QUERY_PROFILING_SLOW_MS', default=100)
+QUERY_PROFILING_DUPLICATES = env.int('QUERY_PROFILING_DUPLICATES', default=5)
+QUERY_PROFILING_TOP = env.int('QUERY_PROFILING_TOP', default=3)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'orders.profiling': {
+            'handlers': ['console'],
+            'level': env('QUERY_PROFILING_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'backend.authentication.CachedTokenAuthentication'
     ],
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'backend.throttling.RateThrottle',
     ],
+    # частота по throttle_scope представления, для остальных - anon/user
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
+        'user': '1000/day',
+        'login': '10/min',
+        'register': '5/hour',
+        'catalog': '120/min',
     },
     
 }
@@ -16,7 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .profiling import QueryMetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('backend.urls')),
+    path('metrics/queries/', QueryMetricsView.as_view(),
+         name='query-metrics'),
 ]